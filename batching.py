@@ -0,0 +1,72 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+# Group commit for /posts/add: concurrent inserts share one transaction.
+BATCH_POSTS = os.environ.get("BATCH_POSTS") == "1"
+BATCH_MAX_ROWS = int(os.environ.get("BATCH_MAX_ROWS", "100"))
+BATCH_MAX_DELAY = float(os.environ.get("BATCH_MAX_DELAY_MS", "5")) / 1000
+
+
+# pylint: disable=W0718
+class WriteBatcher:
+    """Queues rows from concurrent requests and writes them in one call.
+
+    A batch is flushed when it reaches ``max_rows`` or ``max_delay`` seconds
+    after its first row arrived, whichever comes first. ``flush`` receives the
+    rows and returns one ``(id, error_desc)`` pair per row, which is handed
+    back to the request that submitted it. Flushes run one at a time, so rows
+    arriving while a transaction commits simply join the next batch.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[list[dict]], Awaitable[list[tuple]]],
+        max_rows: int,
+        max_delay: float,
+        on_flush: Callable[[int], None] | None = None,
+    ):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._lock: asyncio.Lock | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, row: dict) -> tuple:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        # The loop only keeps weak references to tasks.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[dict, asyncio.Future]]):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.on_flush is not None:
+                self.on_flush(len(batch))
+            try:
+                outcomes = await self.flush([row for row, _ in batch])
+            except Exception as e:
+                outcomes = [(None, str(e))] * len(batch)
+        for (_, future), outcome in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(outcome)
@@ -0,0 +1,25 @@
+"""Shape of the seeded load-test dataset, shared by seed.py and locustfile.py.
+
+Sizes can be overridden with BENCH_USERS / BENCH_BOOKS / BENCH_POSTS so the
+seeder and the load generator always agree.
+"""
+import os
+
+SEED = 1234
+USER_COUNT = int(os.environ.get("BENCH_USERS", "200"))
+BOOK_COUNT = int(os.environ.get("BENCH_BOOKS", "2000"))
+POST_COUNT = int(os.environ.get("BENCH_POSTS", "20000"))
+PASSWORD = "bench-password"
+GENRES = ["fantasy", "sf", "drama", "history", "poetry", "crime", "romance"]
+WORDS = (
+    "book story author chapter plot character reading review novel page "
+    "ending hero world dragon love war peace city night river"
+).split()
+
+
+def username(index: int) -> str:
+    return f"bench_user_{index}"
+
+
+def book_name(index: int) -> str:
+    return f"Bench Book {index}"
@@ -0,0 +1,94 @@
+"""Load scenarios against a database seeded by bench/seed.py."""
+import random
+import uuid
+
+from locust import HttpUser, between, task
+
+from dataset import BOOK_COUNT, PASSWORD, POST_COUNT, USER_COUNT, book_name, username
+
+
+class Reader(HttpUser):
+    """A logged-in user browsing the feed, books and occasionally posting."""
+
+    weight = 10
+    wait_time = between(0.1, 0.5)
+
+    def on_start(self):
+        self.user_id = random.randrange(USER_COUNT) + 1
+        response = self.client.post(
+            "/login",
+            data={"username": username(self.user_id - 1), "password": PASSWORD},
+        )
+        token = response.json()["access_token"]
+        self.client.headers["Authorization"] = f"Bearer {token}"
+
+    @task(10)
+    def feed(self):
+        cursor = None
+        for _ in range(random.randint(1, 3)):
+            params = {"limit": 10}
+            if cursor:
+                params["after"] = cursor
+            response = self.client.get("/posts/feed", params=params, name="/posts/feed")
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                break
+
+    @task(5)
+    def page(self):
+        page = random.randint(1, max(POST_COUNT // 10, 1))
+        self.client.get(f"/posts/get/page/{page}", name="/posts/get/page/{page}")
+
+    @task(5)
+    def post_by_id(self):
+        post_id = random.randint(1, POST_COUNT)
+        self.client.get(f"/posts/get/id/{post_id}", name="/posts/get/id/{id}")
+
+    @task(5)
+    def book_by_id(self):
+        book_id = random.randint(1, BOOK_COUNT)
+        self.client.get(f"/books/get/id/{book_id}", name="/books/get/id/{id}")
+
+    @task(3)
+    def book_by_name(self):
+        name = book_name(random.randrange(BOOK_COUNT))
+        self.client.get(f"/books/get/name/{name}", name="/books/get/name/{name}")
+
+    @task(2)
+    def add_post(self):
+        self.client.post(
+            "/posts/add",
+            json={
+                "user_id": self.user_id,
+                "title": "Load test post",
+                "text": "Written by the locust load test.",
+                "book_id": random.randint(1, BOOK_COUNT),
+            },
+        )
+
+    @task(3)
+    def posts_by_book(self):
+        book_id = random.randint(1, BOOK_COUNT)
+        self.client.get(
+            f"/posts/get/book/{book_id}",
+            params={"limit": 10},
+            name="/posts/get/book/{id}",
+        )
+
+    @task(1)
+    def all_posts(self):
+        self.client.get("/posts/get/all")
+
+
+class Newcomer(HttpUser):
+    """Registers a fresh account and logs in, the bcrypt-heavy path."""
+
+    weight = 1
+    wait_time = between(1, 3)
+
+    @task
+    def register_and_login(self):
+        name = f"load_{uuid.uuid4().hex}"
+        password = uuid.uuid4().hex
+        self.client.post("/reg", json={"username": name, "password": password})
+        self.client.post("/login", data={"username": name, "password": password})
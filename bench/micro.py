@@ -0,0 +1,205 @@
+"""Microbenchmarks for the CPU-bound hot paths, no server required.
+
+    python bench/micro.py [--sizes 10,100,1000] [--min-time 0.5] [--hash-rounds 5]
+
+Each case reports ops/sec and, from a separate tracemalloc pass, the peak
+memory allocated during one operation and the bytes still held after it.
+Post schemas resolve usernames through the user cache in front of an
+in-memory SQLite database. The "cached" case measures warm calls that never
+reach the database; the "uncached" case clears the cache before each call,
+so it includes one batched query.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+
+# pylint: disable=C0413
+from dataset import GENRES, PASSWORD, WORDS, book_name, username
+from jose import jwt
+
+from db import async_session, engine, insert_rows
+from hashing import pwd_context
+from migrations import migrate
+from models.book import Book
+from models.post import Post
+from models.user import User, user_cache
+from routes.auth import ALGORITHM, SECRET_KEY, create_access_token
+from routes.books import BooksResponse
+from routes.posts import PostsResponse
+
+USER_COUNT = 50
+
+
+def make_books(count: int) -> list[Book]:
+    return [
+        Book(
+            id=i + 1,
+            name=book_name(i),
+            author=f"Author {i % 97}",
+            genre=GENRES[i % len(GENRES)],
+        )
+        for i in range(count)
+    ]
+
+
+def make_posts(count: int) -> list[Post]:
+    return [
+        Post(
+            id=i + 1,
+            user_id=i % USER_COUNT + 1,
+            title=" ".join(WORDS[(i + k) % len(WORDS)] for k in range(4)),
+            text=" ".join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(40)),
+            book_name=book_name(i),
+            book_author=f"Author {i % 97}",
+        )
+        for i in range(count)
+    ]
+
+
+def measure(fn, min_time: float) -> tuple[int, float]:
+    """Call ``fn`` in doubling batches until ``min_time`` seconds have passed."""
+    calls, elapsed, batch = 0, 0.0, 1
+    while elapsed < min_time:
+        started = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        elapsed += time.perf_counter() - started
+        calls += batch
+        batch *= 2
+    return calls, elapsed
+
+
+def allocations(fn, calls: int) -> tuple[float, float]:
+    """Average (peak, retained) bytes per call, as seen by tracemalloc."""
+    fn()  # warm caches so one-off imports and lazy setup are not counted
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_total / calls, (end - start) / calls
+
+
+def row(name: str, calls: int, elapsed: float, peak: float, retained: float):
+    print(
+        f"{name:<40} {calls / elapsed:>12.1f} {elapsed / calls * 1e6:>12.1f}"
+        f" {peak / 1024:>10.1f} {retained:>10.0f}"
+    )
+
+
+def report(name: str, fn, min_time: float, alloc_calls: int = 10):
+    calls, elapsed = measure(fn, min_time)
+    row(name, calls, elapsed, *allocations(fn, alloc_calls))
+
+
+async def setup_database():
+    await migrate(engine)
+    async with async_session() as session:
+        await insert_rows(
+            session,
+            User,
+            [{"username": username(i), "password": "x"} for i in range(USER_COUNT)],
+        )
+        await session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--hash-rounds", type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(setup_database())
+    session = async_session()
+
+    print(
+        f"{'case':<40} {'ops/sec':>12} {'us/op':>12}"
+        f" {'peak KiB':>10} {'retained B':>10}"
+    )
+    for size in sizes:
+        books = make_books(size)
+        posts = make_posts(size)
+        book_schemas = Book.from_list_to_schema(books)
+        post_schemas = loop.run_until_complete(Post.from_list_to_schema(session, posts))
+        report(
+            f"Book.from_list_to_schema[{size}]",
+            lambda: Book.from_list_to_schema(books),
+            args.min_time,
+        )
+        report(
+            f"Post.from_list_to_schema[{size}] cached",
+            lambda: loop.run_until_complete(Post.from_list_to_schema(session, posts)),
+            args.min_time,
+        )
+
+        def post_schemas_uncached():
+            user_cache.clear()
+            loop.run_until_complete(Post.from_list_to_schema(session, posts))
+
+        report(
+            f"Post.from_list_to_schema[{size}] uncached",
+            post_schemas_uncached,
+            args.min_time,
+        )
+        report(
+            f"BooksResponse[{size}]",
+            lambda: BooksResponse(code=200, value=book_schemas),
+            args.min_time,
+        )
+        report(
+            f"PostsResponse[{size}]",
+            lambda: PostsResponse(code=200, value=post_schemas),
+            args.min_time,
+        )
+
+    claims = {"sub": username(0), "uid": 1, "ver": 0}
+    token = create_access_token(claims, timedelta(minutes=120))
+    report(
+        "create_access_token",
+        lambda: create_access_token(claims, timedelta(minutes=120)),
+        args.min_time,
+    )
+    report(
+        "jwt.decode",
+        lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]),
+        args.min_time,
+    )
+
+    # bcrypt is deliberately slow; time a fixed number of rounds instead.
+    password_hash = pwd_context.hash(PASSWORD)
+    started = time.perf_counter()
+    for _ in range(args.hash_rounds):
+        pwd_context.verify(PASSWORD, password_hash)
+    elapsed = time.perf_counter() - started
+    row(
+        "pwd_context.verify",
+        args.hash_rounds,
+        elapsed,
+        *allocations(lambda: pwd_context.verify(PASSWORD, password_hash), 1),
+    )
+
+    loop.run_until_complete(session.close())
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
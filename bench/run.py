@@ -0,0 +1,224 @@
+"""Headless load-test runner with regression checks against a stored baseline.
+
+Seeds a database, starts the service, drives it with locust and writes
+p50/p95/p99 and RPS per endpoint to bench_output.txt. Each endpoint is then
+compared with bench/baseline.json; the exit code is 1 when any endpoint's
+p95 grows or its RPS drops by more than --tolerance percent.
+
+    python bench/run.py [--users 50] [--duration 60s] [--update-baseline]
+
+The baseline records the parameters and the machine it was measured with.
+Numbers only compare on the same machine with the same parameters, so runs
+that differ in either skip the comparison; re-record the baseline (and
+commit it) to compare in a new setup.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+OUTPUT = os.path.join(ROOT, "bench_output.txt")
+
+
+def wait_for_server(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/docs", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def run_locust(
+    env: dict, host: str, users: int, spawn_rate: int, duration: str, prefix: str
+):
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "locust",
+            "-f",
+            os.path.join(BENCH_DIR, "locustfile.py"),
+            "--headless",
+            "--host",
+            host,
+            "-u",
+            str(users),
+            "-r",
+            str(spawn_rate),
+            "-t",
+            duration,
+            "--csv",
+            prefix,
+            "--only-summary",
+        ],
+        env=env,
+        check=False,
+    )
+
+
+def read_stats(prefix: str) -> dict:
+    results = {}
+    with open(f"{prefix}_stats.csv", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["Name"] == "Aggregated":
+                continue
+            results[f"{row['Type']} {row['Name']}"] = {
+                "requests": int(row["Request Count"]),
+                "failures": int(row["Failure Count"]),
+                "rps": float(row["Requests/s"]),
+                "p50": float(row["50%"]),
+                "p95": float(row["95%"]),
+                "p99": float(row["99%"]),
+            }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for endpoint, stats in results.items():
+        base = baseline.get(endpoint)
+        if base is None:
+            continue
+        if base["p95"] and stats["p95"] > base["p95"] * (1 + tolerance / 100):
+            regressions.append(
+                f"{endpoint}: p95 {stats['p95']:.0f}ms vs baseline {base['p95']:.0f}ms"
+            )
+        if base["rps"] and stats["rps"] < base["rps"] * (1 - tolerance / 100):
+            regressions.append(
+                f"{endpoint}: {stats['rps']:.1f} rps vs baseline {base['rps']:.1f} rps"
+            )
+    return regressions
+
+
+def recorded_with(args: argparse.Namespace) -> dict:
+    return {
+        "parameters": {
+            "users": args.users,
+            "spawn_rate": args.spawn_rate,
+            "duration": args.duration,
+            "seed_users": args.seed_users,
+            "seed_books": args.seed_books,
+            "seed_posts": args.seed_posts,
+        },
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+    }
+
+
+def report(
+    results: dict, baseline: dict | None, regressions: list[str], notes: list[str]
+) -> str:
+    lines = [
+        f"{'endpoint':<40} {'reqs':>7} {'fail':>5} {'rps':>8} "
+        f"{'p50':>7} {'p95':>7} {'p99':>7}"
+    ]
+    for endpoint, s in sorted(results.items()):
+        lines.append(
+            f"{endpoint:<40} {s['requests']:>7} {s['failures']:>5} {s['rps']:>8.1f} "
+            f"{s['p50']:>7.0f} {s['p95']:>7.0f} {s['p99']:>7.0f}"
+        )
+    lines.append("")
+    if notes:
+        lines.extend(notes)
+    elif baseline is None:
+        lines.append("No baseline stored; run with --update-baseline to record one.")
+    elif regressions:
+        lines.append("REGRESSIONS:")
+        lines.extend(f"  {r}" for r in regressions)
+    else:
+        lines.append("No regressions against baseline.")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--spawn-rate", type=int, default=10)
+    parser.add_argument("--duration", default="60s")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tolerance", type=float, default=15.0)
+    parser.add_argument("--seed-users", type=int, default=200)
+    parser.add_argument("--seed-books", type=int, default=2000)
+    parser.add_argument("--seed-posts", type=int, default=20000)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        SECRET_KEY=os.environ.get("SECRET_KEY", "bench-secret"),
+        HOST="127.0.0.1",
+        PORT=str(args.port),
+        BENCH_USERS=str(args.seed_users),
+        BENCH_BOOKS=str(args.seed_books),
+        BENCH_POSTS=str(args.seed_posts),
+    )
+    env.pop("REINIT_DB", None)
+    subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, "seed.py")],
+        env=env,
+        cwd=ROOT,
+        check=True,
+    )
+
+    host = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, "main.py"], env=env, cwd=ROOT)
+    try:
+        wait_for_server(host)
+        prefix = os.path.join(workdir, "locust")
+        run_locust(env, host, args.users, args.spawn_rate, args.duration, prefix)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    results = read_stats(prefix)
+    baseline, notes = None, []
+    current = recorded_with(args)
+    if os.path.exists(BASELINE):
+        with open(BASELINE, encoding="utf-8") as f:
+            stored = json.load(f)
+        for key in ("parameters", "machine"):
+            if stored[key] != current[key]:
+                notes.append(f"Baseline was recorded with other {key}: {stored[key]}")
+        if notes:
+            notes.append("Comparison skipped; re-record with --update-baseline.")
+        else:
+            baseline = stored["endpoints"]
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    text = report(results, baseline, regressions, notes)
+    with open(OUTPUT, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(text)
+    if args.update_baseline:
+        with open(BASELINE, "w", encoding="utf-8") as f:
+            json.dump(
+                {**current, "endpoints": results}, f, indent=2, sort_keys=True
+            )
+        print(f"Baseline written to {BASELINE}")
+        return
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
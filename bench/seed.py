@@ -0,0 +1,94 @@
+"""Deterministically seed the database pointed to by DATABASE_URL for load tests.
+
+    python bench/seed.py [--users N] [--books N] [--posts N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=C0413
+from dataset import (
+    BOOK_COUNT,
+    GENRES,
+    PASSWORD,
+    POST_COUNT,
+    SEED,
+    USER_COUNT,
+    WORDS,
+    book_name,
+    username,
+)
+from db import async_session, engine, insert_rows
+from hashing import pwd_context
+from migrations import migrate, reset
+from models.book import Book
+from models.post import Post
+from models.stats import rebuild_counters
+from models.user import User
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+async def seed(users: int, books: int, posts: int, batch: int = 1000):
+    rng = random.Random(SEED)
+    await reset(engine)
+    await migrate(engine)
+    # Every bench user shares one password; hash it once.
+    password_hash = pwd_context.hash(PASSWORD)
+    async with async_session() as session:
+        await insert_rows(
+            session,
+            User,
+            [{"username": username(i), "password": password_hash} for i in range(users)],
+        )
+        book_rows = [
+            {
+                "name": book_name(i),
+                "author": f"Author {rng.randrange(max(books // 5, 1))}",
+                "genre": rng.choice(GENRES),
+            }
+            for i in range(books)
+        ]
+        for start in range(0, len(book_rows), batch):
+            await insert_rows(session, Book, book_rows[start : start + batch])
+        for start in range(0, posts, batch):
+            post_rows = []
+            for _ in range(start, min(start + batch, posts)):
+                book_index = rng.randrange(books)
+                book = book_rows[book_index]
+                post_rows.append(
+                    {
+                        "user_id": rng.randrange(users) + 1,
+                        "title": _sentence(rng, 4).capitalize(),
+                        "text": _sentence(rng, 40),
+                        "book_id": book_index + 1,
+                        "book_name": book["name"],
+                        "book_author": book["author"],
+                    }
+                )
+            await insert_rows(session, Post, post_rows)
+        await session.commit()
+    # Rows went in without Stats; count them the way rebuild-stats does.
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_counters)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=USER_COUNT)
+    parser.add_argument("--books", type=int, default=BOOK_COUNT)
+    parser.add_argument("--posts", type=int, default=POST_COUNT)
+    args = parser.parse_args()
+    asyncio.run(seed(args.users, args.books, args.posts))
+    print(f"Seeded {args.users} users, {args.books} books, {args.posts} posts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Each worker process keeps its own copy, so the TTL bounds how long a
+    change made through another worker can go unnoticed.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+ENTITY_CACHE_SIZE = int(os.environ.get("ENTITY_CACHE_SIZE", "10000"))
+ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", "30"))
+
+
+class EntityCache:
+    """Column values of recently read rows, found by primary key or by one
+    unique column (a username, a book name).
+
+    Values are plain dicts, so a hit builds a fresh transient instance and no
+    ORM object is shared between sessions. Models call invalidate() whenever
+    a row is written.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, alias_column: str):
+        self.alias_column = alias_column
+        self.hits = 0
+        self.misses = 0
+        self._rows = TTLCache(maxsize, ttl)
+        self._aliases = TTLCache(maxsize, ttl)
+
+    def get(self, entity_id: int | None = None, alias: Hashable = None) -> dict | None:
+        if entity_id is None:
+            entity_id = self._aliases.get(alias)
+        values = None if entity_id is None else self._rows.get(entity_id)
+        # Ids can be reused after a delete, so an alias must still match.
+        if values is not None and alias is not None:
+            if values[self.alias_column] != alias:
+                values = None
+        if values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return values
+
+    def remember(self, row) -> None:
+        values = {
+            column.key: getattr(row, column.key) for column in row.__table__.columns
+        }
+        self._rows.set(values["id"], values)
+        self._aliases.set(values[self.alias_column], values["id"])
+
+    def invalidate(self, entity_id: int) -> None:
+        self._rows.pop(entity_id)
+
+    def clear(self) -> None:
+        self._rows.clear()
+        self._aliases.clear()
+
+    def __len__(self) -> int:
+        return len(self._rows)
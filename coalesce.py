@@ -0,0 +1,63 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Hashable
+
+from fastapi import Response
+
+import limiter
+from metrics import COALESCED_READS
+from responses import FastJSONResponse
+
+ENABLED = os.environ.get("COALESCE_READS", "1") == "1"
+
+
+class SingleFlight:
+    """Runs at most one computation per key; concurrent callers with the same
+    key await that computation instead of starting their own."""
+
+    def __init__(self, on_join: Callable[[Hashable], None] | None = None):
+        self.on_join = on_join
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        elif self.on_join is not None:
+            self.on_join(key)
+        # A caller that disconnects must not cancel the work others wait on.
+        return await asyncio.shield(task)
+
+
+read_flights = SingleFlight(lambda key: COALESCED_READS.inc(key[0]))
+
+
+async def _render(
+    limit_class: str, handler: Callable[[], Awaitable[Response]]
+) -> tuple[int, bytes, dict]:
+    response = await limiter.run_limited(limit_class, handler)
+    return response.status_code, response.body, dict(response.headers)
+
+
+async def coalesced_response(
+    key: tuple, handler: Callable[[], Awaitable[Response]], limit_class: str
+) -> Response:
+    """Answer concurrent identical reads with one ``handler()`` call.
+
+    ``key`` must capture everything the response depends on, and its first
+    element names the endpoint in metrics. The handler has to open its own
+    session: it may outlive the request that started it. Every caller gets
+    the same encoded body.
+
+    Only the call that runs ``handler()`` takes a slot in the ``limit_class``
+    concurrency limit, so requests that join it are never shed; if that call
+    is shed, everyone waiting on it gets the 503.
+    """
+    if not ENABLED:
+        return await limiter.run_limited(limit_class, handler)
+    status_code, body, headers = await read_flights.do(
+        key, lambda: _render(limit_class, handler)
+    )
+    return FastJSONResponse(body, status_code=status_code, headers=headers)
@@ -1,9 +1,16 @@
+import base64
 import os
+import time
+from typing import AsyncIterator
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from fastapi import Depends
+from sqlalchemy import event, insert, make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -27,17 +34,202 @@ class DbResult:
         return response
 
 
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-engine = create_async_engine(
-    os.environ.get("DATABASE_URL"), echo=os.environ.get("DEBUG") == "1"
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_count = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.checkout_count += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+
+# foreign_keys stays off: User.delete keeps the user's posts, which an enforced
+# posts.user_id reference would reject. Book.delete unlinks its posts itself.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"),
+    "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": os.environ.get("SQLITE_CACHE_SIZE", "-20000"),
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        if value:
+            cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_configured_engine(url: str) -> AsyncEngine:
+    """Build an engine whose pool and SQLite settings come from DB_* / SQLITE_*."""
+    options = {"echo": os.environ.get("DEBUG") == "1"}
+    parsed = make_url(url)
+    is_sqlite = parsed.get_backend_name() == "sqlite"
+    # In-memory SQLite must keep its default single-connection StaticPool.
+    if not (is_sqlite and parsed.database in (None, "", ":memory:")):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "-1")),
+            pool_pre_ping=os.environ.get("DB_POOL_PRE_PING") == "1",
+        )
+    new_engine = create_async_engine(url, **options)
+    if is_sqlite:
+        event.listen(new_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return new_engine
+
+
+async def prime_pool(target: AsyncEngine):
+    """Open and return one connection so the dialect's first-connect setup is
+    done before requests arrive.
+
+    That setup runs under a thread lock on the pool's first connection; with
+    the queue pool above, concurrent first checkouts on one event loop block
+    the loop on that lock and never finish. Call this once per engine at
+    startup, before serving.
+    """
+    async with target.connect():
+        pass
+
+
+def pool_stats(target: AsyncEngine) -> dict:
+    pool = target.pool
+    stats = {"pool": pool.__class__.__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkout_count,
+            checkout_wait_seconds_total=pool.checkout_wait_total,
+            checkout_wait_seconds_max=pool.checkout_wait_max,
+        )
+    return stats
+
+
+engine = create_configured_engine(os.environ.get("DATABASE_URL"))
+# Optional read replica; without DATABASE_READ_URL reads share the primary.
+read_engine = (
+    create_configured_engine(os.environ["DATABASE_READ_URL"])
+    if os.environ.get("DATABASE_READ_URL")
+    else engine
 )
 Base = declarative_base()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+async_read_session = sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False
+)
+
+
+class RequestSessions:
+    """Database sessions for a single request, shared by all of its dependencies.
+
+    Sessions are only created when a dependency asks for one, and an
+    AsyncSession only checks a connection out of the pool on its first query,
+    so requests that never reach the database never touch the pool. Without a
+    read replica the read session is the write session.
+    """
+
+    def __init__(self):
+        self._write: AsyncSession | None = None
+        self._read: AsyncSession | None = None
+
+    def write(self) -> AsyncSession:
+        if self._write is None:
+            self._write = async_session()
+        return self._write
+
+    def read(self) -> AsyncSession:
+        if read_engine is engine:
+            return self.write()
+        if self._read is None:
+            self._read = async_read_session()
+        return self._read
+
+    async def close(self):
+        for session in (self._read, self._write):
+            if session is not None:
+                await session.close()
+
+
+async def get_request_sessions() -> AsyncIterator[RequestSessions]:
+    sessions = RequestSessions()
+    try:
+        yield sessions
+    finally:
+        await sessions.close()
+
+
+def get_session(
+    sessions: RequestSessions = Depends(get_request_sessions),
+) -> AsyncSession:
+    return sessions.write()
+
+
+def get_read_session(
+    sessions: RequestSessions = Depends(get_request_sessions),
+) -> AsyncSession:
+    # Read routes never commit; the transaction is rolled back on close.
+    return sessions.read()
+
 
+async def insert_rows(session: AsyncSession, model, rows: list[dict]) -> list[tuple]:
+    """Insert ``rows`` with one multi-row INSERT inside the caller's transaction.
 
-async def get_session() -> AsyncSession:
-    async with async_session() as session:
-        yield session
+    Returns an ``(id, error_desc)`` pair per row. If the batch violates a
+    constraint, rows are retried one by one under savepoints so a single bad
+    row does not abort the rest; any other error is raised to the caller.
+    """
+    if not rows:
+        return []
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    try:
+        async with session.begin_nested():
+            result = await session.execute(statement, rows)
+            return [(row_id, None) for row_id in result.scalars().all()]
+    except IntegrityError:
+        pass
+    outcomes = []
+    for row in rows:
+        try:
+            async with session.begin_nested():
+                result = await session.execute(statement, [row])
+                outcomes.append((result.scalar_one(), None))
+        except IntegrityError as e:
+            outcomes.append((None, str(e)))
+    return outcomes
@@ -0,0 +1,63 @@
+import hashlib
+import os
+from typing import Hashable
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from cache import TTLCache
+
+ETAG_CACHE_SIZE = int(os.environ.get("ETAG_CACHE_SIZE", "10000"))
+ETAG_CACHE_TTL = float(os.environ.get("ETAG_CACHE_TTL", "30"))
+
+
+def make_etag(schema: BaseModel) -> str:
+    digest = hashlib.blake2b(schema.model_dump_json().encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+class EntityETags:
+    """Last known ETag per entity id, plus aliases (e.g. a book name) that
+    resolve to an id. Models call invalidate() when a row changes."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._etags = TTLCache(maxsize, ttl)
+        self._aliases = TTLCache(maxsize, ttl)
+
+    def get(self, entity_id: int | None = None, alias: Hashable = None) -> str | None:
+        if entity_id is None:
+            entity_id = self._aliases.get(alias)
+        if entity_id is None:
+            return None
+        return self._etags.get(entity_id)
+
+    def remember(self, entity_id: int, schema: BaseModel, alias: Hashable = None) -> str:
+        etag = make_etag(schema)
+        self._etags.set(entity_id, etag)
+        if alias is not None:
+            self._aliases.set(alias, entity_id)
+        return etag
+
+    def invalidate(self, entity_id: int):
+        self._etags.pop(entity_id)
+
+    def clear(self):
+        self._etags.clear()
+        self._aliases.clear()
+
+
+book_etags = EntityETags(ETAG_CACHE_SIZE, ETAG_CACHE_TTL)
+user_etags = EntityETags(ETAG_CACHE_SIZE, ETAG_CACHE_TTL)
+post_etags = EntityETags(ETAG_CACHE_SIZE, ETAG_CACHE_TTL)
+
+
+def etag_matches(request: Request, etag: str | None) -> bool:
+    header = request.headers.get("if-none-match")
+    if etag is None or header is None:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
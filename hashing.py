@@ -0,0 +1,38 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt releases the GIL, so a thread pool is enough to keep it off the loop.
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", "64"))
+HASH_RETRY_AFTER = 1
+
+_executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= HASH_QUEUE_LIMIT:
+        raise HashPoolBusy("Too many password operations in progress")
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run(pwd_context.verify, password, hashed)
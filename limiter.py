@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import CONCURRENCY_LIMIT, SHED_REQUESTS
+
+ENABLED = os.environ.get("LOAD_SHEDDING") == "1"
+QUEUE_TIMEOUT = float(os.environ.get("LIMIT_QUEUE_TIMEOUT_MS", "1000")) / 1000
+RETRY_AFTER = 1
+# Multiplicative decrease applied when a request overshoots its class target.
+BACKOFF = 0.9
+
+AUTH_PATHS = ("/login", "/reg")
+HEAVY_PATHS = (
+    "/posts/stream/all",
+    "/posts/search",
+    "/posts/get/username/",
+    "/posts/get/title/",
+    "/posts/bulk",
+    "/books/bulk",
+)
+# Monitoring and docs must stay reachable while the service is shedding.
+EXEMPT_PATHS = ("/metrics", "/db/pool", "/debug/", "/docs", "/redoc", "/openapi.json")
+# Coalesced reads take their class slot in run_limited(), held only by the
+# request that runs the query; requests joining it wait without a slot.
+COALESCED_PATHS = (
+    "/posts/get/all",
+    "/posts/get/page/",
+    "/posts/feed",
+    "/posts/get/book/",
+)
+
+# route class -> (initial limit, max limit, queue size, target latency ms)
+DEFAULTS = {
+    "auth": (4, 16, 32, 1000),
+    "heavy": (2, 8, 16, 2000),
+    "read": (32, 256, 256, 100),
+    "write": (16, 64, 128, 250),
+}
+
+
+def route_class(method: str, path: str) -> str | None:
+    if method == "OPTIONS" or path.startswith(EXEMPT_PATHS + COALESCED_PATHS):
+        return None
+    if path in AUTH_PATHS:
+        return "auth"
+    if path.startswith(HEAVY_PATHS):
+        return "heavy"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+
+class AdaptiveLimit:
+    """In-flight cap for one route class with a bounded FIFO wait queue.
+
+    The cap follows AIMD: it grows by about one slot per limit's worth of
+    requests that finish under ``target`` seconds while the cap is saturated,
+    and shrinks by ``BACKOFF`` (at most once per ``target`` interval) when a
+    request finishes over it.
+    """
+
+    def __init__(
+        self, name: str, initial: int, maximum: int, queue_size: int, target: float
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.queue_size = queue_size
+        self.target = target
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        CONCURRENCY_LIMIT.set(int(self.limit), name)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            # release() hands its slot over by resolving the future.
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(None)
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def release(self, latency: float | None):
+        self.in_flight -= 1
+        if latency is not None:
+            self._adapt(latency)
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _adapt(self, latency: float):
+        if latency > self.target:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.target:
+                self.limit = max(1.0, self.limit * BACKOFF)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit):
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        CONCURRENCY_LIMIT.set(int(self.limit), self.name)
+
+
+def _setting(name: str, key: str, default: int) -> int:
+    return int(os.environ.get(f"LIMIT_{name.upper()}_{key}", str(default)))
+
+
+def build_limits() -> dict[str, AdaptiveLimit]:
+    return {
+        name: AdaptiveLimit(
+            name,
+            _setting(name, "INITIAL", initial),
+            _setting(name, "MAX", maximum),
+            _setting(name, "QUEUE", queue_size),
+            _setting(name, "TARGET_MS", target_ms) / 1000,
+        )
+        for name, (initial, maximum, queue_size, target_ms) in DEFAULTS.items()
+    }
+
+
+limits = build_limits()
+
+
+def shed_response() -> JSONResponse:
+    return JSONResponse(
+        {"detail": "Server is overloaded, retry later"},
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER)},
+    )
+
+
+async def run_limited(
+    name: str, handler: Callable[[], Awaitable[Response]]
+) -> Response:
+    """Run ``handler()`` under the ``name`` class limit from inside an endpoint,
+    answering with 503 when no slot frees up in time."""
+    if not ENABLED:
+        return await handler()
+    limit = limits[name]
+    if not await limit.acquire(QUEUE_TIMEOUT):
+        SHED_REQUESTS.inc(name)
+        return shed_response()
+    started = time.perf_counter()
+    latency = None
+    try:
+        response = await handler()
+        latency = time.perf_counter() - started
+        return response
+    finally:
+        limit.release(latency)
+
+
+class LoadSheddingMiddleware:
+    """Caps in-flight requests per route class and answers the excess with
+    503 and Retry-After instead of letting every request queue."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = limits.get(route_class(scope["method"], scope["path"]))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        if not await limit.acquire(QUEUE_TIMEOUT):
+            SHED_REQUESTS.inc(limit.name)
+            await shed_response()(scope, receive, send)
+            return
+        started = time.perf_counter()
+        latency = None
+        try:
+            await self.app(scope, receive, send)
+            latency = time.perf_counter() - started
+        finally:
+            limit.release(latency)
@@ -1,7 +1,11 @@
 import asyncio
-from service import run, init_models
+import sys
+from service import run, init_models, rebuild_stats
 
 
 if __name__ == "__main__":
-    asyncio.run(init_models())
-    run()
+    if sys.argv[1:] == ["rebuild-stats"]:
+        asyncio.run(rebuild_stats())
+    else:
+        asyncio.run(init_models())
+        run()
@@ -0,0 +1,261 @@
+import os
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from db import TimedQueuePool, engine, pool_stats, read_engine
+from models.book import book_cache
+from models.user import user_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    # Every series is per process; see render().
+    pairs = [f'worker="{os.getpid()}"']
+    pairs.extend(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for values, total in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, description: str, labels: tuple = (), buckets=LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        names = self.labels + ("le",)
+        for values, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("route", "method", "status")
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("route", "method")
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database statements executed per request",
+    ("route",),
+    COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Database time spent per request", ("route",)
+)
+ENVELOPE_ERRORS = Counter(
+    "api_envelope_errors_total",
+    "Responses whose envelope code is not 200",
+    ("route", "code"),
+)
+BCRYPT_TIME = Histogram(
+    "auth_bcrypt_seconds", "Time spent verifying passwords in authenticate_user"
+)
+POST_BATCH_ROWS = Histogram(
+    "post_batch_rows",
+    "Posts written per group-commit batch",
+    (),
+    (1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+SHED_REQUESTS = Counter(
+    "http_requests_shed_total",
+    "Requests rejected with 503 by the concurrency limiter",
+    ("route_class",),
+)
+COALESCED_READS = Counter(
+    "http_requests_coalesced_total",
+    "Reads answered by joining an identical in-flight request",
+    ("endpoint",),
+)
+CONCURRENCY_LIMIT = Gauge(
+    "http_concurrency_limit",
+    "Current adaptive in-flight limit per route class",
+    ("route_class",),
+)
+REGISTRY = [
+    REQUESTS,
+    LATENCY,
+    REQUEST_QUERIES,
+    REQUEST_DB_TIME,
+    ENVELOPE_ERRORS,
+    BCRYPT_TIME,
+    POST_BATCH_ROWS,
+    SHED_REQUESTS,
+    CONCURRENCY_LIMIT,
+    COALESCED_READS,
+]
+
+# [statement count, seconds] for the request being served
+_db_stats: ContextVar[list | None] = ContextVar("db_stats", default=None)
+_ENVELOPE_CODE = re.compile(rb'^\{"code":(\d+)')
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - conn.info.pop("query_started")
+
+
+def instrument_engine(target: AsyncEngine):
+    sync_engine = target.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_execute)
+
+
+def _render_pools() -> list[str]:
+    lines = []
+    engines = {"primary": engine}
+    if read_engine is not engine:
+        engines["replica"] = read_engine
+    gauges = {
+        "checked_out": "db_pool_checked_out",
+        "overflow": "db_pool_overflow",
+        "checkouts": "db_pool_checkouts_total",
+        "checkout_wait_seconds_total": "db_pool_checkout_wait_seconds_total",
+        "checkout_wait_seconds_max": "db_pool_checkout_wait_seconds_max",
+    }
+    for role, target in engines.items():
+        if not isinstance(target.pool, TimedQueuePool):
+            continue
+        stats = pool_stats(target)
+        for key, name in gauges.items():
+            lines.append(f'{name}{_labels(("engine",), (role,))} {stats[key]}')
+    return lines
+
+
+def _render_caches() -> list[str]:
+    lines = []
+    caches = {"users": user_cache, "books": book_cache}
+    for name, cache in caches.items():
+        labels = _labels(("cache",), (name,))
+        lines.append(f"entity_cache_hits_total{labels} {cache.hits}")
+        lines.append(f"entity_cache_misses_total{labels} {cache.misses}")
+        lines.append(f"entity_cache_entries{labels} {len(cache)}")
+    return lines
+
+
+def render() -> str:
+    """Exposition text for the metrics of this process only.
+
+    Metrics are kept in memory per process and every sample is labelled with
+    the worker's pid. With WORKERS > 1 a scrape of /metrics is answered by
+    whichever worker accepts it, so it shows one worker's series and never a
+    total: only rely on /metrics with a single worker per scrape target.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(_render_pools())
+    lines.extend(_render_caches())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Records per-route latency, status, DB usage and envelope error codes."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: dict | None = None
+
+    def _route_template(self, scope: Scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        stats = [0, 0.0]
+        token = _db_stats.set(stats)
+        response = {"status": 500, "code": None}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body" and response["code"] is None:
+                match = _ENVELOPE_CODE.match(message.get("body", b""))
+                response["code"] = int(match.group(1)) if match else 0
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _db_stats.reset(token)
+            route = self._route_template(scope)
+            method = scope["method"]
+            LATENCY.observe(time.perf_counter() - started, route, method)
+            REQUESTS.inc(route, method, response["status"])
+            REQUEST_QUERIES.observe(stats[0], route)
+            REQUEST_DB_TIME.observe(stats[1], route)
+            if response["code"] and response["code"] != 200:
+                ENVELOPE_ERRORS.inc(route, response["code"])
@@ -0,0 +1,219 @@
+from typing import Callable, List
+
+from sqlalchemy import Column, Connection, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy import inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateColumn
+
+from db import Base
+
+# pylint: disable=W0611
+import models.book
+import models.post
+import models.user
+from models.stats import rebuild_counters
+
+schema_version = Table(
+    "schema_version", Base.metadata, Column("version", Integer, nullable=False)
+)
+
+
+def _add_column(conn: Connection, table: str, column: Column):
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    ddl = str(CreateColumn(column).compile(dialect=conn.dialect))
+    for foreign_key in column.foreign_keys:
+        target_table, target_column = foreign_key.target_fullname.split(".")
+        ddl += f" REFERENCES {target_table} ({target_column})"
+        if foreign_key.ondelete:
+            ddl += f" ON DELETE {foreign_key.ondelete}"
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+
+def _create_index(conn: Connection, name: str, table: str, *columns: str):
+    conn.execute(
+        text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+    )
+
+
+# Migrations spell out the tables they create instead of using the models,
+# so each step keeps meaning the same schema as the models change.
+def create_tables(conn: Connection):
+    metadata = MetaData()
+    Table(
+        "users",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("username", String, unique=True),
+        Column("password", String),
+    )
+    Table(
+        "books",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("name", String, unique=True),
+        Column("author", String),
+    )
+    Table(
+        "posts",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("title", String),
+        Column("text", String),
+        Column("book_name", String),
+        Column("book_author", String),
+        Column("user_id", Integer, ForeignKey("users.id")),
+    )
+    metadata.create_all(conn)
+
+
+def add_user_token_version(conn: Connection):
+    _add_column(
+        conn,
+        "users",
+        Column("token_version", Integer, nullable=False, server_default="0"),
+    )
+
+
+def add_lookup_indexes(conn: Connection):
+    _create_index(conn, "ix_posts_user_id", "posts", "user_id")
+    _create_index(conn, "ix_posts_title", "posts", "title")
+    _create_index(conn, "ix_books_author", "books", "author")
+
+
+def add_book_genre(conn: Connection):
+    _add_column(conn, "books", Column("genre", String))
+    _create_index(conn, "ix_books_genre", "books", "genre")
+
+
+def add_posts_fts(conn: Connection):
+    # Full-text search uses SQLite FTS5; other backends fall back to LIKE.
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(
+        text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+            "title, text, content='posts', content_rowid='id')"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN "
+            "INSERT INTO posts_fts(rowid, title, text) "
+            "VALUES (new.id, new.title, new.text); END"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN "
+            "INSERT INTO posts_fts(posts_fts, rowid, title, text) "
+            "VALUES ('delete', old.id, old.title, old.text); END"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE ON posts BEGIN "
+            "INSERT INTO posts_fts(posts_fts, rowid, title, text) "
+            "VALUES ('delete', old.id, old.title, old.text); "
+            "INSERT INTO posts_fts(rowid, title, text) "
+            "VALUES (new.id, new.title, new.text); END"
+        )
+    )
+    conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+
+
+def add_post_book_id(conn: Connection):
+    _add_column(
+        conn,
+        "posts",
+        Column("book_id", Integer, ForeignKey("books.id", ondelete="SET NULL")),
+    )
+    _create_index(conn, "ix_posts_book_id", "posts", "book_id")
+    if conn.dialect.name == "sqlite":
+        # Only title/text feed the search index; don't re-index rows on
+        # updates to other columns such as the backfill below.
+        conn.execute(text("DROP TRIGGER IF EXISTS posts_fts_update"))
+        conn.execute(
+            text(
+                "CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, text ON posts "
+                "BEGIN "
+                "INSERT INTO posts_fts(posts_fts, rowid, title, text) "
+                "VALUES ('delete', old.id, old.title, old.text); "
+                "INSERT INTO posts_fts(rowid, title, text) "
+                "VALUES (new.id, new.title, new.text); END"
+            )
+        )
+    # Link existing posts to the book with the same name and author.
+    conn.execute(
+        text(
+            "UPDATE posts SET book_id = (SELECT books.id FROM books "
+            "WHERE books.name = posts.book_name AND books.author = posts.book_author) "
+            "WHERE book_id IS NULL"
+        )
+    )
+
+
+def add_stats_counters(conn: Connection):
+    metadata = MetaData()
+    Table(
+        "user_post_counts",
+        metadata,
+        Column("user_id", Integer, primary_key=True, autoincrement=False),
+        Column("total", Integer, nullable=False),
+    )
+    Table(
+        "book_post_counts",
+        metadata,
+        Column("book_id", Integer, primary_key=True, autoincrement=False),
+        Column("total", Integer, nullable=False),
+    )
+    Table(
+        "author_book_counts",
+        metadata,
+        Column("author", String, primary_key=True),
+        Column("total", Integer, nullable=False),
+    )
+    metadata.create_all(conn)
+    rebuild_counters(conn)
+
+
+# Append only: a migration's position in this list is its schema version.
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    create_tables,
+    add_user_token_version,
+    add_lookup_indexes,
+    add_book_genre,
+    add_posts_fts,
+    add_post_book_id,
+    add_stats_counters,
+]
+
+
+def _current_version(conn: Connection) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def _set_version(conn: Connection, version: int):
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert().values(version=version))
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    async with engine.begin() as conn:
+        current = await conn.run_sync(_current_version)
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        async with engine.begin() as conn:
+            await conn.run_sync(step)
+            await conn.run_sync(_set_version, version)
+        print(f"Applied migration {version}: {step.__name__}")
+    return len(MIGRATIONS)
+
+
+async def reset(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            await conn.execute(text("DROP TABLE IF EXISTS posts_fts"))
+        await conn.run_sync(Base.metadata.drop_all)
@@ -1,19 +1,31 @@
 from __future__ import annotations
 
-from typing import List
+import os
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, ForeignKey, Integer, String, delete, select
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import Column, ForeignKey, Integer, String, column, delete, func
+from sqlalchemy import select, table, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import mapped_column
 
-from db import Base, DbResult
+from cache import ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, EntityCache, TTLCache
+from db import Base, DbResult, insert_rows
+from etags import book_etags, post_etags
+from models.stats import Stats
+
+genre_counts = TTLCache(1, float(os.environ.get("GENRE_COUNTS_TTL", "300")))
+# Recently read books by id and name; add and delete invalidate.
+book_cache = EntityCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, "name")
+# models.post imports this module, so posts are reached through a bare table.
+posts_table = table("posts", column("book_id"))
 
 
 class BookSchema(BaseModel):
     id: int = Field(exclude=False, title="id")
     name: str = Field(exclude=False, title="name")
     author: str = Field(exclude=False, title="author")
+    genre: Optional[str] = Field(default=None, exclude=False, title="genre")
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -22,39 +34,129 @@ class Book(Base):
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     name = Column(String, unique=True)
-    author = Column(String)
+    author = Column(String, index=True)
+    genre = Column(String, index=True)
 
     async def add(self, session: AsyncSession) -> DbResult:
         try:
             session.add(self)
+            await Stats.count_books(session, [self.author], 1)
             await session.commit()
+            genre_counts.clear()
+            book_cache.invalidate(self.id)
+            book_etags.invalidate(self.id)
             return DbResult.result(self.id)
         except Exception as e:
             await session.rollback()
             return DbResult.error(str(e), False)
 
+    async def add_many(session: AsyncSession, rows: List[dict]) -> DbResult:
+        try:
+            outcomes = [None] * len(rows)
+            result = await session.execute(
+                select(Book.name).where(Book.name.in_({r["name"] for r in rows}))
+            )
+            taken = set(result.scalars().all())
+            valid = []
+            for index, row in enumerate(rows):
+                if row["name"] in taken:
+                    outcomes[index] = (None, f"Book {row['name']!r} already exists")
+                else:
+                    taken.add(row["name"])
+                    valid.append(index)
+            inserted = await insert_rows(session, Book, [rows[i] for i in valid])
+            for index, outcome in zip(valid, inserted):
+                outcomes[index] = outcome
+            await Stats.count_books(
+                session,
+                [rows[i]["author"] for i in valid if outcomes[i][0] is not None],
+                1,
+            )
+            await session.commit()
+            genre_counts.clear()
+            for book_id, _ in outcomes:
+                if book_id is not None:
+                    book_cache.invalidate(book_id)
+                    book_etags.invalidate(book_id)
+            return DbResult.result(outcomes)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
     async def get_by_id(session: AsyncSession, book_id: int) -> DbResult:
         try:
+            values = book_cache.get(book_id)
+            if values is not None:
+                return DbResult.result(Book(**values))
             result = await session.execute(select(Book).where(Book.id == book_id))
             data = result.scalars().first()
-            await session.commit()
+            if data is not None:
+                book_cache.remember(data)
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
     async def get_by_name(session: AsyncSession, book_name: int) -> DbResult:
         try:
+            values = book_cache.get(alias=book_name)
+            if values is not None:
+                return DbResult.result(Book(**values))
             result = await session.execute(select(Book).where(Book.name == book_name))
             data = result.scalars().first()
-            await session.commit()
+            if data is not None:
+                book_cache.remember(data)
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_by_genre(
+        session: AsyncSession, genre: str, after: int | None, limit: int
+    ) -> DbResult:
+        try:
+            query = select(Book).where(Book.genre == genre).order_by(Book.id)
+            if after is not None:
+                query = query.where(Book.id > after)
+            result = await session.execute(query.limit(limit))
+            data = result.scalars().all()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_genre_counts(session: AsyncSession) -> DbResult:
+        try:
+            data = genre_counts.get("all")
+            if data is None:
+                result = await session.execute(
+                    select(Book.genre, func.count())
+                    .where(Book.genre.is_not(None))
+                    .group_by(Book.genre)
+                )
+                data = {genre: count for genre, count in result}
+                genre_counts.set("all", data)
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
     async def delete(session: AsyncSession, book_id: int) -> DbResult:
         try:
-            _ = await session.execute(delete(Book).where(Book.id == book_id))
+            # SQLite doesn't enforce ON DELETE SET NULL here, and a freed id is
+            # handed to the next book, so unlink the posts in this transaction.
+            await session.execute(
+                update(posts_table)
+                .where(posts_table.c.book_id == book_id)
+                .values(book_id=None)
+            )
+            result = await session.execute(
+                delete(Book).where(Book.id == book_id).returning(Book.author)
+            )
+            await Stats.count_books(session, result.scalars().all(), -1)
+            await Stats.forget_book(session, book_id)
             await session.commit()
+            genre_counts.clear()
+            book_cache.invalidate(book_id)
+            book_etags.invalidate(book_id)
+            # Serialized posts embed their book_id.
+            post_etags.clear()
             return DbResult.result(True)
         except Exception as e:
             await session.rollback()
@@ -66,6 +168,7 @@ class Book(Base):
                 id=book.id,
                 name=book.name,
                 author=book.author,
+                genre=book.genre,
             )
             return book_schema
         except Exception:
@@ -76,9 +179,3 @@ class Book(Base):
             return [Book.from_one_to_schema(b) for b in books]
         except Exception:
             return []
-
-
-async def init_book(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
@@ -1,13 +1,30 @@
 from __future__ import annotations
 
-from typing import List
+import html
+import re
+from typing import AsyncIterator, List, Optional
 
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, ForeignKey, Integer, String, delete, select
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    column,
+    delete,
+    func,
+    literal_column,
+    or_,
+    select,
+    table,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import mapped_column
 
-from db import Base, DbResult
+from db import Base, DbResult, insert_rows
+from etags import post_etags
+from models.book import Book
+from models.stats import Stats
 from models.user import User
 
 
@@ -18,6 +35,32 @@ class PostSchema(BaseModel):
     text: str = Field(exclude=False, title="text")
     book_name: str = Field(exclude=False, title="book_name")
     book_author: str = Field(exclude=False, title="book_name")
+    book_id: Optional[int] = Field(default=None, exclude=False, title="book_id")
+
+
+class PostSearchSchema(PostSchema):
+    title_snippet: Optional[str] = Field(exclude=False, title="title_snippet")
+    text_snippet: Optional[str] = Field(exclude=False, title="text_snippet")
+    rank: float = Field(exclude=False, title="rank")
+
+
+posts_fts = table("posts_fts", column("rowid"))
+# snippet() marks matches with control characters, which highlight() turns
+# into tags once the post's own text has been HTML-escaped.
+MATCH_OPEN = "\x02"
+MATCH_CLOSE = "\x03"
+SNIPPET_OPEN = "<b>"
+SNIPPET_CLOSE = "</b>"
+
+
+def highlight(snippet: Optional[str]) -> Optional[str]:
+    if snippet is None:
+        return None
+    return (
+        html.escape(snippet)
+        .replace(MATCH_OPEN, SNIPPET_OPEN)
+        .replace(MATCH_CLOSE, SNIPPET_CLOSE)
+    )
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -25,27 +68,112 @@ class Post(Base):
     __tablename__ = "posts"
 
     id = Column(Integer, autoincrement=True, primary_key=True)
-    title = Column(String)
+    title = Column(String, index=True)
     text = Column(String)
     book_name = Column(String)
     book_author = Column(String)
-    user_id = mapped_column(ForeignKey("users.id"))
+    user_id = mapped_column(ForeignKey("users.id"), index=True)
+    book_id = mapped_column(
+        ForeignKey("books.id", ondelete="SET NULL"), index=True, nullable=True
+    )
 
     async def add(self, session: AsyncSession) -> DbResult:
         try:
             session.add(self)
+            await Stats.count_posts(session, [(self.user_id, self.book_id)], 1)
             await session.commit()
             await session.refresh(self)
+            post_etags.invalidate(self.id)
             return DbResult.result(self.id)
         except Exception as e:
             await session.rollback()
             return DbResult.error(e)
 
+    async def link_books(session: AsyncSession, rows: List[dict]) -> DbResult:
+        """Fill in book_id or book_name/book_author on each row from the other.
+
+        The value is a per-row error description, or None when the row is
+        usable. A name that matches no book (or a different author) is kept
+        as free text with no book_id, as before books were linked.
+        """
+        try:
+            ids = {r["book_id"] for r in rows if r.get("book_id") is not None}
+            names = {
+                r["book_name"]
+                for r in rows
+                if r.get("book_id") is None and r.get("book_name") is not None
+            }
+            books = {}
+            if ids or names:
+                result = await session.execute(
+                    select(Book.id, Book.name, Book.author).where(
+                        or_(Book.id.in_(ids), Book.name.in_(names))
+                    )
+                )
+                books = {row.id: row for row in result}
+            by_name = {book.name: book for book in books.values()}
+            errors = []
+            for row in rows:
+                if row.get("book_id") is not None:
+                    book = books.get(row["book_id"])
+                    if book is None:
+                        errors.append("Book with this book_id not found")
+                        continue
+                    row["book_name"], row["book_author"] = book.name, book.author
+                elif row.get("book_name") is None or row.get("book_author") is None:
+                    errors.append("book_id or book_name and book_author is required")
+                    continue
+                else:
+                    book = by_name.get(row["book_name"])
+                    if book is not None and book.author == row["book_author"]:
+                        row["book_id"] = book.id
+                errors.append(None)
+            return DbResult.result(errors)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def add_many(session: AsyncSession, rows: List[dict]) -> DbResult:
+        try:
+            outcomes = [None] * len(rows)
+            users = await User.get_usernames(session, [r["user_id"] for r in rows])
+            if users.is_error:
+                return users
+            books = await Post.link_books(session, rows)
+            if books.is_error:
+                return books
+            valid = []
+            for index, row in enumerate(rows):
+                if row["user_id"] not in users.value:
+                    outcomes[index] = (None, "User with this user_id not found")
+                elif books.value[index] is not None:
+                    outcomes[index] = (None, books.value[index])
+                else:
+                    valid.append(index)
+            inserted = await insert_rows(session, Post, [rows[i] for i in valid])
+            for index, outcome in zip(valid, inserted):
+                outcomes[index] = outcome
+            await Stats.count_posts(
+                session,
+                [
+                    (rows[i]["user_id"], rows[i].get("book_id"))
+                    for i in valid
+                    if outcomes[i][0] is not None
+                ],
+                1,
+            )
+            await session.commit()
+            for post_id, _ in outcomes:
+                if post_id is not None:
+                    post_etags.invalidate(post_id)
+            return DbResult.result(outcomes)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
     async def get_by_id(session: AsyncSession, post_id: int) -> DbResult:
         try:
             result = await session.execute(select(Post).where(Post.id == post_id))
             data = result.scalars().first()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
@@ -56,22 +184,60 @@ class Post(Base):
                 select(Post).offset(10 * (page - 1)).limit(10)
             )
             data = result.scalars().all()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-    
+
+    async def get_by_cursor(
+        session: AsyncSession, after: int | None, limit: int
+    ) -> DbResult:
+        try:
+            query = select(Post).order_by(Post.id).limit(limit)
+            if after is not None:
+                query = query.where(Post.id > after)
+            result = await session.execute(query)
+            data = result.scalars().all()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_by_book(
+        session: AsyncSession, book_id: int, after: int | None, limit: int
+    ) -> DbResult:
+        try:
+            query = select(Post).where(Post.book_id == book_id).order_by(Post.id)
+            if after is not None:
+                query = query.where(Post.id > after)
+            result = await session.execute(query.limit(limit))
+            data = result.scalars().all()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
     async def get_all(session: AsyncSession) -> DbResult:
         try:
             result = await session.execute(
                 select(Post)
             )
             data = result.scalars().all()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
+    async def stream_all(
+        session: AsyncSession, batch_size: int
+    ) -> AsyncIterator[list[PostSchema]]:
+        # The join on users leaves out posts whose author was deleted, as
+        # from_list_to_schema does for the list endpoints.
+        result = await session.stream(
+            select(Post, User.username)
+            .join(User, User.id == Post.user_id)
+            .order_by(Post.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield [Post.to_schema(post, username) for post, username in rows]
+
     async def get_by_username(session: AsyncSession, _username: String) -> DbResult:
         try:
             result = await session.execute(
@@ -80,7 +246,6 @@ class Post(Base):
                 )
             )
             data = result.scalars().all()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
@@ -89,45 +254,116 @@ class Post(Base):
         try:
             result = await session.execute(select(Post).where(Post.title == _title))
             data = result.scalars().all()
-            await session.commit()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    def to_fts_query(terms: str) -> str:
+        # Quote every word so user input can't inject FTS5 query syntax.
+        return " ".join('"' + word + '"' for word in re.findall(r"\w+", terms))
+
+    async def search(
+        session: AsyncSession, terms: str, offset: int, limit: int
+    ) -> DbResult:
+        try:
+            fts_query = Post.to_fts_query(terms)
+            if not fts_query:
+                return DbResult.result([])
+            if session.bind.dialect.name == "sqlite":
+                fts = literal_column("posts_fts")
+                rank = func.bm25(fts).label("rank")
+                query = (
+                    select(
+                        Post,
+                        func.snippet(fts, 0, MATCH_OPEN, MATCH_CLOSE, "…", 8),
+                        func.snippet(fts, 1, MATCH_OPEN, MATCH_CLOSE, "…", 16),
+                        rank,
+                    )
+                    .join(posts_fts, posts_fts.c.rowid == Post.id)
+                    .where(fts.op("MATCH")(fts_query))
+                    .order_by(rank)
+                )
+            else:
+                escaped = re.sub(r"([\\%_])", r"\\\1", terms)
+                pattern = f"%{escaped}%"
+                query = (
+                    select(Post, Post.title, Post.text, literal_column("0.0"))
+                    .where(
+                        or_(
+                            Post.title.ilike(pattern, escape="\\"),
+                            Post.text.ilike(pattern, escape="\\"),
+                        )
+                    )
+                    .order_by(Post.id)
+                )
+            result = await session.execute(query.offset(offset).limit(limit))
+            data = result.all()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
     async def delete(session: AsyncSession, post_id: int) -> DbResult:
         try:
-            _ = await session.execute(delete(Post).where(Post.id == post_id))
+            result = await session.execute(
+                delete(Post)
+                .where(Post.id == post_id)
+                .returning(Post.user_id, Post.book_id)
+            )
+            await Stats.count_posts(session, result.all(), -1)
             await session.commit()
+            post_etags.invalidate(post_id)
             return DbResult.result(True)
         except Exception as e:
             await session.rollback()
             return DbResult.error(str(e), False)
 
+    def to_schema(post: Post, username: str) -> PostSchema:
+        return PostSchema(
+            id=post.id,
+            title=post.title,
+            username=username,
+            text=post.text,
+            book_name=post.book_name,
+            book_author=post.book_author,
+            book_id=post.book_id,
+        )
+
     async def from_one_to_schema(session: AsyncSession, post: Post) -> PostSchema:
         try:
-            user = await User.get_by_id(session, post.user_id)
-            if not user.is_error:
-                post_schema = PostSchema(
-                    id=post.id,
-                    title=post.title,
-                    username=user.value.username,
-                    text=post.text,
-                    book_name=post.book_name,
-                    book_author=post.book_author,
-                )
-                return post_schema
-            return None
+            schemas = await Post.from_list_to_schema(session, [post])
+            return schemas[0] if schemas else None
         except Exception:
             return None
 
-    async def from_list_to_schema(session, posts: List[Post]) -> list[PostSchema]:
+    async def from_search_to_schema(session, hits: list) -> list[PostSearchSchema]:
         try:
-            return [await Post.from_one_to_schema(session, r) for r in posts]
+            usernames = await User.get_usernames(session, [h[0].user_id for h in hits])
+            if usernames.is_error:
+                return []
+            return [
+                PostSearchSchema(
+                    **Post.to_schema(post, usernames.value[post.user_id]).model_dump(),
+                    title_snippet=highlight(title_snippet),
+                    text_snippet=highlight(text_snippet),
+                    rank=rank,
+                )
+                for post, title_snippet, text_snippet, rank in hits
+                if post.user_id in usernames.value
+            ]
         except Exception:
             return []
 
-
-async def init_post(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    async def from_list_to_schema(session, posts: List[Post]) -> list[PostSchema]:
+        try:
+            usernames = await User.get_usernames(session, [p.user_id for p in posts])
+            if usernames.is_error:
+                return []
+            # User.delete keeps a user's posts; like stream_all's join on users,
+            # lists leave out posts whose author no longer exists.
+            return [
+                Post.to_schema(p, usernames.value[p.user_id])
+                for p in posts
+                if p.user_id in usernames.value
+            ]
+        except Exception:
+            return []
@@ -0,0 +1,130 @@
+from collections import Counter
+from typing import Hashable, Iterable
+
+from sqlalchemy import Column, Connection, Integer, String, column, delete, func
+from sqlalchemy import insert, select, table, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import Base, DbResult
+
+posts_table = table("posts", column("user_id"), column("book_id"))
+books_table = table("books", column("id"), column("author"))
+
+
+class UserPostCount(Base):
+    __tablename__ = "user_post_counts"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False, default=0)
+
+
+class BookPostCount(Base):
+    __tablename__ = "book_post_counts"
+
+    book_id = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False, default=0)
+
+
+class AuthorBookCount(Base):
+    __tablename__ = "author_book_counts"
+
+    author = Column(String, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+
+async def _apply(session: AsyncSession, model, deltas: Counter):
+    """Add ``deltas`` (key -> change) to a counter table in the session's
+    transaction. Increments upsert; decrements only touch existing rows."""
+    key = model.__table__.primary_key.columns[0]
+    increments = [
+        {key.name: value, "total": delta}
+        for value, delta in deltas.items()
+        if delta > 0
+    ]
+    if increments:
+        dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(model.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key], set_={"total": model.total + statement.excluded.total}
+        )
+        await session.execute(statement, increments)
+    for value, delta in deltas.items():
+        if delta < 0:
+            await session.execute(
+                update(model).where(key == value).values(total=model.total + delta)
+            )
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class Stats:
+    """Counters kept in step with posts and books.
+
+    The count_* methods only execute statements; callers run them inside the
+    transaction that writes the rows and commit both together.
+    """
+
+    async def count_posts(
+        session: AsyncSession, posts: Iterable[tuple[int, int | None]], delta: int
+    ):
+        users, books = Counter(), Counter()
+        for user_id, book_id in posts:
+            if user_id is not None:
+                users[user_id] += delta
+            if book_id is not None:
+                books[book_id] += delta
+        await _apply(session, UserPostCount, users)
+        await _apply(session, BookPostCount, books)
+
+    async def count_books(
+        session: AsyncSession, authors: Iterable[str | None], delta: int
+    ):
+        counts = Counter()
+        for author in authors:
+            if author is not None:
+                counts[author] += delta
+        await _apply(session, AuthorBookCount, counts)
+
+    async def forget_book(session: AsyncSession, book_id: int):
+        await session.execute(
+            delete(BookPostCount).where(BookPostCount.book_id == book_id)
+        )
+
+    async def get(session: AsyncSession, model, key: Hashable) -> DbResult:
+        try:
+            result = await session.get(model, key)
+            return DbResult.result(0 if result is None else result.total)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+
+def rebuild_counters(conn: Connection):
+    """Recompute every counter table from the posts and books tables."""
+    for model in (UserPostCount, BookPostCount, AuthorBookCount):
+        conn.execute(delete(model))
+    conn.execute(
+        insert(UserPostCount).from_select(
+            ["user_id", "total"],
+            select(posts_table.c.user_id, func.count())
+            .where(posts_table.c.user_id.is_not(None))
+            .group_by(posts_table.c.user_id),
+        )
+    )
+    # Book.delete unlinks its posts; the join also skips links to missing books
+    # left by writes from before it did.
+    conn.execute(
+        insert(BookPostCount).from_select(
+            ["book_id", "total"],
+            select(posts_table.c.book_id, func.count())
+            .join(books_table, books_table.c.id == posts_table.c.book_id)
+            .group_by(posts_table.c.book_id),
+        )
+    )
+    conn.execute(
+        insert(AuthorBookCount).from_select(
+            ["author", "total"],
+            select(books_table.c.author, func.count())
+            .where(books_table.c.author.is_not(None))
+            .group_by(books_table.c.author),
+        )
+    )
@@ -1,12 +1,26 @@
 from __future__ import annotations
 
+import os
 from typing import List
 
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, String, delete, select
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import Column, Integer, String, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, EntityCache, TTLCache
 from db import Base, DbResult
+from etags import post_etags, user_etags
+
+# user id -> (username, current token version), so stateless auth can skip the
+# users table. SQLite reuses a deleted user's id, so tokens are also checked
+# against the username the id currently belongs to.
+token_versions = TTLCache(
+    int(os.environ.get("TOKEN_CACHE_SIZE", "10000")),
+    float(os.environ.get("TOKEN_CACHE_TTL", "60")),
+)
+REVOKED = (None, -1)
+# Recently read users by id and username; add, revoke and delete invalidate.
+user_cache = EntityCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, "username")
 
 
 class UserSchema(BaseModel):
@@ -21,6 +35,7 @@ class User(Base):
     id = Column(Integer, autoincrement=True, primary_key=True)
     username = Column(String, unique=True)
     password = Column(String, unique=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     async def add(self, session: AsyncSession) -> DbResult:
         try:
@@ -28,6 +43,8 @@ class User(Base):
             session.add(copy)
             await session.commit()
             await session.refresh(copy)
+            user_cache.invalidate(copy.id)
+            user_etags.invalidate(copy.id)
             return DbResult.result(copy.id)
         except Exception as e:
             await session.rollback()
@@ -35,28 +52,77 @@ class User(Base):
 
     async def get_by_id(session: AsyncSession, user_id: int) -> DbResult:
         try:
+            values = user_cache.get(user_id)
+            if values is not None:
+                return DbResult.result(User(**values))
             result = await session.execute(select(User).where(User.id == user_id))
             data = result.scalars().first()
-            await session.commit()
+            if data is not None:
+                user_cache.remember(data)
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
     async def get_by_username(session: AsyncSession, user_name: str) -> DbResult:
         try:
+            values = user_cache.get(alias=user_name)
+            if values is not None:
+                return DbResult.result(User(**values))
             result = await session.execute(
                 select(User).where(User.username == user_name)
             )
             data = result.scalars().first()
-            await session.commit()
+            if data is not None:
+                user_cache.remember(data)
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
+    async def get_usernames(session: AsyncSession, user_ids: List[int]) -> DbResult:
+        try:
+            usernames = {}
+            missing = set()
+            for user_id in set(user_ids):
+                values = user_cache.get(user_id)
+                if values is None:
+                    missing.add(user_id)
+                else:
+                    usernames[user_id] = values["username"]
+            if missing:
+                result = await session.execute(select(User).where(User.id.in_(missing)))
+                for user in result.scalars():
+                    user_cache.remember(user)
+                    usernames[user.id] = user.username
+            return DbResult.result(usernames)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def revoke_tokens(session: AsyncSession, user_id: int) -> DbResult:
+        try:
+            result = await session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(token_version=User.token_version + 1)
+                .returning(User.username, User.token_version)
+            )
+            row = result.one_or_none()
+            await session.commit()
+            user_cache.invalidate(user_id)
+            token_versions.set(user_id, REVOKED if row is None else tuple(row))
+            return DbResult.result(None if row is None else row.token_version)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
     async def delete(session: AsyncSession, user_id: int) -> DbResult:
         try:
             _ = await session.execute(delete(User).where(User.id == user_id))
             await session.commit()
+            token_versions.set(user_id, REVOKED)
+            user_cache.invalidate(user_id)
+            user_etags.invalidate(user_id)
+            # Serialized posts embed the author's username.
+            post_etags.clear()
             return DbResult.result(True)
         except Exception as e:
             await session.rollback()
@@ -77,9 +143,3 @@ class User(Base):
             return [User.from_one_to_schema(g) for g in users]
         except Exception:
             return []
-
-
-async def init_user(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
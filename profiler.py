@@ -0,0 +1,116 @@
+"""Opt-in per-request SQL profiler (SQL_PROFILE=1).
+
+Counts and times every statement a request executes, groups them by
+statement shape and flags shapes repeated within one request, which is how
+N+1 loops show up. Each response gets an X-SQL-Profile header and recent
+summaries are kept for /debug/sql.
+"""
+import logging
+import os
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ENABLED = os.environ.get("SQL_PROFILE") == "1"
+SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_MS", "100"))
+REPEAT_THRESHOLD = int(os.environ.get("SQL_REPEAT_THRESHOLD", "5"))
+HISTORY_SIZE = int(os.environ.get("SQL_PROFILE_HISTORY", "50"))
+
+logger = logging.getLogger(__name__)
+history: deque = deque(maxlen=HISTORY_SIZE)
+
+_profile: ContextVar[dict | None] = ContextVar("sql_profile", default=None)
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    return _IN_LIST.sub("(?, ...)", _SPACE.sub(" ", statement).strip())
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["profile_started"] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("profile_started")
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+    profile = _profile.get()
+    if profile is None:
+        return
+    profile["queries"] += 1
+    profile["seconds"] += elapsed
+    shape = statement_shape(statement)
+    entry = profile["shapes"].setdefault(shape, [0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed
+
+
+def instrument_engine(target: AsyncEngine):
+    sync_engine = target.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_execute)
+
+
+def summarize(method: str, path: str, profile: dict) -> dict:
+    repeated = [
+        {"statement": shape, "count": count, "ms": round(seconds * 1000, 3)}
+        for shape, (count, seconds) in profile["shapes"].items()
+        if count >= REPEAT_THRESHOLD
+    ]
+    return {
+        "method": method,
+        "path": path,
+        "queries": profile["queries"],
+        "ms": round(profile["seconds"] * 1000, 3),
+        "distinct": len(profile["shapes"]),
+        "repeated": repeated,
+    }
+
+
+class SQLProfilerMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = {"queries": 0, "seconds": 0.0, "shapes": {}}
+        token = _profile.set(profile)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                # Statements run after the headers (e.g. streamed bodies) only
+                # show up in /debug/sql.
+                partial = summarize(scope["method"], scope["path"], profile)
+                headers = MutableHeaders(scope=message)
+                headers["X-SQL-Profile"] = (
+                    f"queries={partial['queries']}; ms={partial['ms']}; "
+                    f"repeated={len(partial['repeated'])}"
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profile.reset(token)
+            summary = summarize(scope["method"], scope["path"], profile)
+            history.append(summary)
+            for item in summary["repeated"]:
+                logger.warning(
+                    "Possible N+1 in %s %s: %d x %s",
+                    summary["method"],
+                    summary["path"],
+                    item["count"],
+                    item["statement"],
+                )
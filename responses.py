@@ -0,0 +1,29 @@
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response that encodes pydantic models with pydantic-core and any
+    other content with orjson instead of the stdlib json module. Bytes are
+    taken as already encoded JSON."""
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return orjson.dumps(content)
+
+
+def envelope_response(envelope: type[BaseModel], **fields) -> FastJSONResponse:
+    """Respond with an envelope around values that are already validated
+    schemas.
+
+    The envelope is built with ``model_construct`` and returned as a response,
+    so neither its ``__init__`` nor the route's ``response_model`` validates
+    the payload again, and it is encoded to JSON in a single pass.
+    """
+    fields.setdefault("code", 200)
+    fields.setdefault("error_desc", None)
+    return FastJSONResponse(envelope.model_construct(**fields))
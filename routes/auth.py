@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from typing import Annotated
 import os
@@ -5,12 +6,13 @@ from dotenv import load_dotenv
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import get_session
-from models.user import User
+from db import get_read_session, get_session
+from metrics import BCRYPT_TIME
+from hashing import HASH_RETRY_AFTER, HashPoolBusy, verify_password
+from models.user import REVOKED, User, token_versions
 
 
 class Token(BaseModel):
@@ -20,6 +22,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None = None
+    user_id: int | None = None
+    version: int | None = None
 
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -30,7 +34,9 @@ if os.path.exists(dotenv_path):
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Trust the user id and token version embedded in the JWT instead of
+# loading the user row on every request.
+STATELESS_AUTH = os.environ.get("STATELESS_AUTH") == "1"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
@@ -38,7 +44,10 @@ async def authenticate_user(session, username: str, password: str):
     user = await User.get_by_username(session, username)
     if user.value is None:
         return False
-    if not pwd_context.verify(password, user.value.password):
+    started = time.perf_counter()
+    verified = await verify_password(password, user.value.password)
+    BCRYPT_TIME.observe(time.perf_counter() - started)
+    if not verified:
         return False
     return user.value
 
@@ -54,9 +63,24 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+async def check_token_version(session, token_data: TokenData) -> bool:
+    current = token_versions.get(token_data.user_id)
+    if current is None:
+        user = await User.get_by_id(session, token_data.user_id)
+        if user.is_error:
+            return False
+        current = (
+            REVOKED
+            if user.value is None
+            else (user.value.username, user.value.token_version)
+        )
+        token_versions.set(token_data.user_id, current)
+    return current != REVOKED and current == (token_data.username, token_data.version)
+
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,12 +92,24 @@ async def get_current_user(
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
+        token_data = TokenData(
+            username=username, user_id=payload.get("uid"), version=payload.get("ver")
+        )
     except JWTError:
         raise credentials_exception
+    if STATELESS_AUTH and token_data.user_id is not None:
+        if not await check_token_version(session, token_data):
+            raise credentials_exception
+        return User(
+            id=token_data.user_id,
+            username=token_data.username,
+            token_version=token_data.version,
+        )
     user = await User.get_by_username(session, token_data.username)
     if user.value is None:
         raise credentials_exception
+    if token_data.version is not None and token_data.version != user.value.token_version:
+        raise credentials_exception
     return user.value
 
 
@@ -83,7 +119,16 @@ def init_auth_routes(app: FastAPI):
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
         session: AsyncSession = Depends(get_session),
     ):
-        user = await authenticate_user(session, form_data.username, form_data.password)
+        try:
+            user = await authenticate_user(
+                session, form_data.username, form_data.password
+            )
+        except HashPoolBusy as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(HASH_RETRY_AFTER)},
+            )
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -92,6 +137,24 @@ def init_auth_routes(app: FastAPI):
             )
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data={
+                "sub": user.username,
+                "uid": user.id,
+                "ver": user.token_version,
+            },
+            expires_delta=access_token_expires,
         )
+        token_versions.set(user.id, (user.username, user.token_version))
         return {"access_token": access_token, "token_type": "bearer"}
+
+    @app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+    async def logout(
+        current_user: Annotated[User, Depends(get_current_user)],
+        session: AsyncSession = Depends(get_session),
+    ):
+        result = await User.revoke_tokens(session, current_user.id)
+        if result.is_error:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=result.error_desc,
+            )
@@ -1,18 +1,26 @@
 from typing import Annotated, Optional
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Query, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
+from db import DbResult, decode_cursor, encode_cursor, get_read_session, get_session
+from etags import book_etags, etag_matches, not_modified
 from models.book import Book, BookSchema
 from models.user import User
+from responses import envelope_response
 from routes.auth import get_current_user
 
 
+GENRE_PAGE_SIZE = 10
+GENRE_MAX_PAGE_SIZE = 100
+BULK_MAX_ITEMS = 10000
+
+
 class NewBook(BaseModel):
     name: str = Field()
     author: str = Field()
+    genre: Optional[str] = Field(default=None)
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -62,15 +70,62 @@ class BooksResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
     error_desc: Optional[str] = Field(exclude=False, title="description")
     value: Optional[list[BookSchema]] = Field(exclude=False, title="value")
+    next_cursor: Optional[str] = Field(exclude=False, title="next_cursor")
 
     def __init__(
         self,
         code: int = 200,
         error_desc: Optional[str] = None,
         value: Optional[list[BookSchema]] = [],
+        next_cursor: Optional[str] = None,
+    ):
+        super().__init__(
+            code=code, error_desc=error_desc, value=value, next_cursor=next_cursor
+        )
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class GenresResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[dict[str, int]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[dict[str, int]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class BulkItem(BaseModel):
+    index: int = Field(exclude=False, title="index")
+    id: Optional[int] = Field(exclude=False, title="id")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class BulkAddResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[BulkItem]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[BulkItem]] = [],
     ):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
+    def from_outcomes(outcomes: list[tuple]) -> list[BulkItem]:
+        return [
+            BulkItem(index=index, id=row_id, error_desc=error_desc)
+            for index, (row_id, error_desc) in enumerate(outcomes)
+        ]
+
 
 def init_books_routes(app: FastAPI, oauth2_scheme):
     @app.post(
@@ -85,6 +140,7 @@ def init_books_routes(app: FastAPI, oauth2_scheme):
             new_book = Book()
             new_book.name = data.name
             new_book.author = data.author
+            new_book.genre = data.genre
             result = await new_book.add(session)
             if result.is_error is True:
                 return AddResponse(code=500, error_desc=result.error_desc)
@@ -92,17 +148,48 @@ def init_books_routes(app: FastAPI, oauth2_scheme):
         except Exception as e:
             return AddResponse(code=500, error_desc=str(e))
 
+    @app.post("/books/bulk", response_model=BulkAddResponse)
+    async def add_bulk(
+        current_user: Annotated[User, Depends(get_current_user)],
+        data: list[NewBook],
+        session: AsyncSession = Depends(get_session),
+    ):
+        try:
+            if len(data) > BULK_MAX_ITEMS:
+                return BulkAddResponse(
+                    code=413, error_desc=f"At most {BULK_MAX_ITEMS} books per request"
+                )
+            result = await Book.add_many(session, [book.model_dump() for book in data])
+            if result.is_error is True:
+                return BulkAddResponse(code=500, error_desc=result.error_desc)
+            return BulkAddResponse(
+                code=200, value=BulkAddResponse.from_outcomes(result.value)
+            )
+        except Exception as e:
+            return BulkAddResponse(code=500, error_desc=str(e))
+
     @app.get("/books/get/id/{id}", response_model=BookResponse)
     async def get_by_id(
         current_user: Annotated[User, Depends(get_current_user)],
         id: int,
-        session: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = book_etags.get(id)
+            if etag_matches(request, etag):
+                return not_modified(etag)
             result: DbResult = await Book.get_by_id(session, id)
             if result.is_error is True:
                 return BookResponse(code=500, error_desc=result.error_desc)
-            return BookResponse(code=200, value=Book.from_one_to_schema(result.value))
+            book = Book.from_one_to_schema(result.value)
+            if book is not None:
+                etag = book_etags.remember(book.id, book)
+                if etag_matches(request, etag):
+                    return not_modified(etag)
+                response.headers["ETag"] = etag
+            return BookResponse(code=200, value=book)
         except Exception as e:
             return BookResponse(code=500, error_desc=str(e))
 
@@ -110,27 +197,67 @@ def init_books_routes(app: FastAPI, oauth2_scheme):
     async def get_by_genre(
         current_user: Annotated[User, Depends(get_current_user)],
         genre: str,
-        session: AsyncSession = Depends(get_session),
+        after: Optional[str] = None,
+        limit: int = Query(GENRE_PAGE_SIZE, ge=1, le=GENRE_MAX_PAGE_SIZE),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Book.get_by_genre(session, genre)
+            try:
+                after_id = decode_cursor(after) if after else None
+            except ValueError:
+                return BooksResponse(code=400, error_desc="Invalid cursor")
+            result: DbResult = await Book.get_by_genre(
+                session, genre, after_id, limit + 1
+            )
             if result.is_error is True:
                 return BooksResponse(code=500, error_desc=result.error_desc)
-            return BooksResponse(code=200, value=Book.from_list_to_schema(result.value))
+            books = result.value[:limit]
+            next_cursor = None
+            if len(result.value) > limit:
+                next_cursor = encode_cursor(books[-1].id)
+            return envelope_response(
+                BooksResponse,
+                value=Book.from_list_to_schema(books),
+                next_cursor=next_cursor,
+            )
         except Exception as e:
             return BooksResponse(code=500, error_desc=str(e))
 
+    @app.get("/books/genres", response_model=GenresResponse)
+    async def get_genres(
+        current_user: Annotated[User, Depends(get_current_user)],
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result: DbResult = await Book.get_genre_counts(session)
+            if result.is_error is True:
+                return GenresResponse(code=500, error_desc=result.error_desc)
+            return GenresResponse(code=200, value=result.value)
+        except Exception as e:
+            return GenresResponse(code=500, error_desc=str(e))
+
     @app.get("/books/get/name/{name}", response_model=BookResponse)
     async def get_by_name(
         current_user: Annotated[User, Depends(get_current_user)],
         name: str,
-        session: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = book_etags.get(alias=name)
+            if etag_matches(request, etag):
+                return not_modified(etag)
             result: DbResult = await Book.get_by_name(session, name)
             if result.is_error is True:
                 return BookResponse(code=500, error_desc=result.error_desc)
-            return BookResponse(code=200, value=Book.from_one_to_schema(result.value))
+            book = Book.from_one_to_schema(result.value)
+            if book is not None:
+                etag = book_etags.remember(book.id, book, alias=name)
+                if etag_matches(request, etag):
+                    return not_modified(etag)
+                response.headers["ETag"] = etag
+            return BookResponse(code=200, value=book)
         except Exception as e:
             return BookResponse(code=500, error_desc=str(e))
 
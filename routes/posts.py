@@ -1,21 +1,46 @@
 from typing import Annotated, Optional
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.post import Post, PostSchema
+from batching import BATCH_MAX_DELAY, BATCH_MAX_ROWS, BATCH_POSTS, WriteBatcher
+from coalesce import coalesced_response
+from db import (
+    DbResult,
+    RequestSessions,
+    async_read_session,
+    async_session,
+    decode_cursor,
+    encode_cursor,
+    get_read_session,
+    get_request_sessions,
+    get_session,
+)
+from etags import etag_matches, not_modified, post_etags
+from metrics import POST_BATCH_ROWS
+from models.post import Post, PostSchema, PostSearchSchema
 from models.user import User
+from responses import FastJSONResponse, envelope_response
 from routes.auth import get_current_user
 
 
+FEED_PAGE_SIZE = 10
+FEED_MAX_PAGE_SIZE = 100
+STREAM_BATCH_SIZE = 500
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_PAGE_SIZE = 50
+BULK_MAX_ITEMS = 10000
+
+
 class NewPost(BaseModel):
     user_id: int
     title: str
     text: str
-    book_name: str
-    book_author: str
+    book_id: Optional[int] = None
+    book_name: Optional[str] = None
+    book_author: Optional[str] = None
 
 
 class DeleteResponse(BaseModel):
@@ -64,15 +89,125 @@ class PostsResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
     error_desc: Optional[str] = Field(exclude=False, title="description")
     value: Optional[list[PostSchema]] = Field(exclude=False, title="value")
+    next_cursor: Optional[str] = Field(exclude=False, title="next_cursor")
 
     def __init__(
         self,
         code: int = 200,
         error_desc: Optional[str] = None,
         value: Optional[list[PostSchema]] = [],
+        next_cursor: Optional[str] = None,
+    ):
+        super().__init__(
+            code=code, error_desc=error_desc, value=value, next_cursor=next_cursor
+        )
+
+
+async def stream_posts_ndjson():
+    # The body is produced after the handler returns, so the stream owns its
+    # session instead of borrowing the request-scoped one.
+    async with async_read_session() as session:
+        async for batch in Post.stream_all(session, STREAM_BATCH_SIZE):
+            yield "".join(post.model_dump_json() + "\n" for post in batch)
+
+
+async def insert_posts(rows: list[dict]) -> list[tuple]:
+    async with async_session() as session:
+        result = await Post.add_many(session, rows)
+    if result.is_error is True:
+        raise Exception(result.error_desc)
+    return result.value
+
+
+post_batcher = WriteBatcher(
+    insert_posts, BATCH_MAX_ROWS, BATCH_MAX_DELAY, POST_BATCH_ROWS.observe
+)
+
+
+async def read_posts(fetch, limit: int | None = None) -> Response:
+    """Load a list of posts in a session of its own and encode its envelope.
+
+    ``fetch(session)`` returns a DbResult. With ``limit`` it is expected to
+    load one row more than that, which is dropped and turned into next_cursor.
+    This runs as a coalesced flight that may outlive the request starting it,
+    so it can't borrow that request's session; see ``coalesced_posts``.
+    """
+    async with async_read_session() as session:
+        try:
+            result: DbResult = await fetch(session)
+            if result.is_error is True:
+                return FastJSONResponse(
+                    PostsResponse(code=500, error_desc=result.error_desc)
+                )
+            posts, next_cursor = result.value, None
+            if limit is not None:
+                posts = result.value[:limit]
+                if len(result.value) > limit:
+                    next_cursor = encode_cursor(posts[-1].id)
+            return envelope_response(
+                PostsResponse,
+                value=await Post.from_list_to_schema(session, posts),
+                next_cursor=next_cursor,
+            )
+        except Exception as e:
+            return FastJSONResponse(PostsResponse(code=500, error_desc=str(e)))
+
+
+async def coalesced_posts(
+    sessions: RequestSessions,
+    key: tuple,
+    fetch,
+    limit_class: str,
+    limit: int | None = None,
+) -> Response:
+    # The request's sessions served the auth lookup; close them so their
+    # connection is back in the pool before the flight checks out its own.
+    await sessions.close()
+    return await coalesced_response(
+        key, lambda: read_posts(fetch, limit), limit_class
+    )
+
+
+class PostSearchResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[PostSearchSchema]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[PostSearchSchema]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+class BulkItem(BaseModel):
+    index: int = Field(exclude=False, title="index")
+    id: Optional[int] = Field(exclude=False, title="id")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class BulkAddResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[BulkItem]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[BulkItem]] = [],
     ):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
+    def from_outcomes(outcomes: list[tuple]) -> list[BulkItem]:
+        return [
+            BulkItem(index=index, id=row_id, error_desc=error_desc)
+            for index, (row_id, error_desc) in enumerate(outcomes)
+        ]
+
 
 def init_posts_routes(app: FastAPI, oauth2_scheme):
     @app.post(
@@ -84,15 +219,27 @@ def init_posts_routes(app: FastAPI, oauth2_scheme):
         session: AsyncSession = Depends(get_session),
     ):
         try:
+            if BATCH_POSTS:
+                post_id, error_desc = await post_batcher.submit(data.model_dump())
+                if post_id is None:
+                    return AddResponse(code=500, error_desc=error_desc)
+                return AddResponse(code=200, value=post_id)
             user = await User.get_by_id(session, data.user_id)
             if user.is_error:
                 raise Exception("User with this user_id not found")
+            book = data.model_dump(include={"book_id", "book_name", "book_author"})
+            linked = await Post.link_books(session, [book])
+            if linked.is_error is True:
+                return AddResponse(code=500, error_desc=linked.error_desc)
+            if linked.value[0] is not None:
+                raise Exception(linked.value[0])
             new_post = Post()
             new_post.title = data.title
             new_post.user_id = user.value.id
             new_post.text = data.text
-            new_post.book_name = data.book_name
-            new_post.book_author = data.book_author
+            new_post.book_id = book["book_id"]
+            new_post.book_name = book["book_name"]
+            new_post.book_author = book["book_author"]
             result = await new_post.add(session)
             if result.is_error is True:
                 return AddResponse(code=500, error_desc=result.error_desc)
@@ -100,50 +247,131 @@ def init_posts_routes(app: FastAPI, oauth2_scheme):
         except Exception as e:
             return AddResponse(code=500, error_desc=str(e))
 
-    @app.get("/posts/get/page/{page}", response_model=PostsResponse)
-    async def get_by_page(
+    @app.post("/posts/bulk", response_model=BulkAddResponse)
+    async def add_bulk(
         current_user: Annotated[User, Depends(get_current_user)],
-        page: int,
+        data: list[NewPost],
         session: AsyncSession = Depends(get_session),
     ):
         try:
-            result: DbResult = await Post.get_by_page(session, page)
+            if len(data) > BULK_MAX_ITEMS:
+                return BulkAddResponse(
+                    code=413, error_desc=f"At most {BULK_MAX_ITEMS} posts per request"
+                )
+            result = await Post.add_many(session, [post.model_dump() for post in data])
             if result.is_error is True:
-                return PostsResponse(code=500, error_desc=result.error_desc)
-            return PostsResponse(
-                code=200, value=await Post.from_list_to_schema(session, result.value)
+                return BulkAddResponse(code=500, error_desc=result.error_desc)
+            return BulkAddResponse(
+                code=200, value=BulkAddResponse.from_outcomes(result.value)
             )
         except Exception as e:
-            return PostsResponse(code=500, error_desc=str(e))
-    
+            return BulkAddResponse(code=500, error_desc=str(e))
+
+    @app.get("/posts/get/page/{page}", response_model=PostsResponse)
+    async def get_by_page(
+        current_user: Annotated[User, Depends(get_current_user)],
+        page: int,
+        sessions: RequestSessions = Depends(get_request_sessions),
+    ):
+        return await coalesced_posts(
+            sessions,
+            ("posts_page", page),
+            lambda session: Post.get_by_page(session, page),
+            "read",
+        )
+
+    @app.get("/posts/feed", response_model=PostsResponse)
+    async def get_feed(
+        current_user: Annotated[User, Depends(get_current_user)],
+        after: Optional[str] = None,
+        limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+        sessions: RequestSessions = Depends(get_request_sessions),
+    ):
+        try:
+            after_id = decode_cursor(after) if after else None
+        except ValueError:
+            return PostsResponse(code=400, error_desc="Invalid cursor")
+        return await coalesced_posts(
+            sessions,
+            ("posts_feed", after_id, limit),
+            lambda session: Post.get_by_cursor(session, after_id, limit + 1),
+            "read",
+            limit,
+        )
+
+    @app.get("/posts/get/book/{id}", response_model=PostsResponse)
+    async def get_by_book(
+        current_user: Annotated[User, Depends(get_current_user)],
+        id: int,
+        after: Optional[str] = None,
+        limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+        sessions: RequestSessions = Depends(get_request_sessions),
+    ):
+        try:
+            after_id = decode_cursor(after) if after else None
+        except ValueError:
+            return PostsResponse(code=400, error_desc="Invalid cursor")
+        return await coalesced_posts(
+            sessions,
+            ("posts_book", id, after_id, limit),
+            lambda session: Post.get_by_book(session, id, after_id, limit + 1),
+            "read",
+            limit,
+        )
 
     @app.get("/posts/get/all", response_model=PostsResponse)
     async def get_by_page(
-        session: AsyncSession = Depends(get_session),
+        sessions: RequestSessions = Depends(get_request_sessions),
+    ):
+        return await coalesced_posts(sessions, ("posts_all",), Post.get_all, "heavy")
+
+    @app.get("/posts/stream/all")
+    async def stream_all():
+        return StreamingResponse(
+            stream_posts_ndjson(), media_type="application/x-ndjson"
+        )
+
+    @app.get("/posts/search", response_model=PostSearchResponse)
+    async def search(
+        current_user: Annotated[User, Depends(get_current_user)],
+        q: str = Query(min_length=1),
+        page: int = Query(1, ge=1),
+        limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Post.get_all(session)
+            result: DbResult = await Post.search(session, q, limit * (page - 1), limit)
             if result.is_error is True:
-                return PostsResponse(code=500, error_desc=result.error_desc)
-            return PostsResponse(
-                code=200, value=await Post.from_list_to_schema(session, result.value)
+                return PostSearchResponse(code=500, error_desc=result.error_desc)
+            return envelope_response(
+                PostSearchResponse,
+                value=await Post.from_search_to_schema(session, result.value),
             )
         except Exception as e:
-            return PostsResponse(code=500, error_desc=str(e))
+            return PostSearchResponse(code=500, error_desc=str(e))
 
     @app.get("/posts/get/id/{id}", response_model=PostResponse)
     async def get_by_id(
         current_user: Annotated[User, Depends(get_current_user)],
         id: int,
-        session: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = post_etags.get(id)
+            if etag_matches(request, etag):
+                return not_modified(etag)
             result: DbResult = await Post.get_by_id(session, id)
             if result.is_error is True:
                 return PostResponse(code=500, error_desc=result.error_desc)
-            return PostResponse(
-                code=200, value=await Post.from_one_to_schema(session, result.value)
-            )
+            post = await Post.from_one_to_schema(session, result.value)
+            if post is not None:
+                etag = post_etags.remember(post.id, post)
+                if etag_matches(request, etag):
+                    return not_modified(etag)
+                response.headers["ETag"] = etag
+            return PostResponse(code=200, value=post)
         except Exception as e:
             return PostResponse(code=500, error_desc=str(e))
 
@@ -151,14 +379,16 @@ def init_posts_routes(app: FastAPI, oauth2_scheme):
     async def get_by_username(
         current_user: Annotated[User, Depends(get_current_user)],
         username: str,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await Post.get_by_username(session, username)
             if result.is_error is True:
                 return PostsResponse(code=500, error_desc=result.error_desc)
-            return PostsResponse(
-                code=200, value=await Post.from_list_to_schema(session, result.value)
+            return envelope_response(
+                PostsResponse,
+                value=await Post.from_list_to_schema(session, result.value),
+                next_cursor=None,
             )
         except Exception as e:
             return PostsResponse(code=500, error_desc=str(e))
@@ -167,14 +397,16 @@ def init_posts_routes(app: FastAPI, oauth2_scheme):
     async def get_by_title(
         current_user: Annotated[User, Depends(get_current_user)],
         title: str,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await Post.get_by_title(session, title)
             if result.is_error is True:
                 return PostsResponse(code=500, error_desc=result.error_desc)
-            return PostsResponse(
-                code=200, value=await Post.from_list_to_schema(session, result.value)
+            return envelope_response(
+                PostsResponse,
+                value=await Post.from_list_to_schema(session, result.value),
+                next_cursor=None,
             )
         except Exception as e:
             return PostsResponse(code=500, error_desc=str(e))
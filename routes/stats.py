@@ -0,0 +1,59 @@
+from typing import Annotated, Optional
+
+from fastapi import Depends, FastAPI
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import DbResult, get_read_session
+from models.stats import AuthorBookCount, BookPostCount, Stats, UserPostCount
+from models.user import User
+from routes.auth import get_current_user
+
+
+class CountResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[int] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[int] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_stats_routes(app: FastAPI, oauth2_scheme):
+    async def read_counter(session: AsyncSession, model, key) -> CountResponse:
+        try:
+            result: DbResult = await Stats.get(session, model, key)
+            if result.is_error is True:
+                return CountResponse(code=500, error_desc=result.error_desc)
+            return CountResponse(code=200, value=result.value)
+        except Exception as e:
+            return CountResponse(code=500, error_desc=str(e))
+
+    @app.get("/stats/users/{id}/posts", response_model=CountResponse)
+    async def get_user_posts(
+        current_user: Annotated[User, Depends(get_current_user)],
+        id: int,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        return await read_counter(session, UserPostCount, id)
+
+    @app.get("/stats/books/{id}/posts", response_model=CountResponse)
+    async def get_book_posts(
+        current_user: Annotated[User, Depends(get_current_user)],
+        id: int,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        return await read_counter(session, BookPostCount, id)
+
+    @app.get("/stats/authors/{author}/books", response_model=CountResponse)
+    async def get_author_books(
+        current_user: Annotated[User, Depends(get_current_user)],
+        author: str,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        return await read_counter(session, AuthorBookCount, author)
@@ -0,0 +1,61 @@
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+import metrics
+import profiler
+from db import engine, pool_stats, read_engine
+
+
+class PoolStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[dict[str, dict]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[dict[str, dict]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+class SQLProfileResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[dict]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[dict]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_system_routes(app: FastAPI):
+    @app.get("/db/pool", response_model=PoolStatsResponse)
+    async def get_pool_stats():
+        try:
+            value = {"primary": pool_stats(engine)}
+            if read_engine is not engine:
+                value["replica"] = pool_stats(read_engine)
+            return PoolStatsResponse(code=200, value=value)
+        except Exception as e:
+            return PoolStatsResponse(code=500, error_desc=str(e))
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(
+            metrics.render(), media_type="text/plain; version=0.0.4"
+        )
+
+    if profiler.ENABLED:
+
+        @app.get("/debug/sql", response_model=SQLProfileResponse)
+        async def get_sql_profile():
+            return SQLProfileResponse(code=200, value=list(profiler.history))
@@ -1,16 +1,15 @@
 from typing import Annotated, Any, Optional
 
-from fastapi import Depends, FastAPI
-from passlib.context import CryptContext
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import get_session
+from db import get_read_session, get_session
+from etags import etag_matches, not_modified, user_etags
+from hashing import HASH_RETRY_AFTER, HashPoolBusy, hash_password
 from models.user import User, UserSchema
 from routes.auth import get_current_user
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class NewUser(BaseModel):
     username: str
@@ -82,11 +81,17 @@ def init_users_routes(app: FastAPI, oauth2_scheme):
         try:
             new_user = User()
             new_user.username = data.username
-            new_user.password = pwd_context.hash(data.password)
+            new_user.password = await hash_password(data.password)
             result = await new_user.add(session)
             if result.is_error is True:
                 return AddResponse(code=500, error_desc=result.error_desc)
             return AddResponse(code=200, value=result.value)
+        except HashPoolBusy as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(HASH_RETRY_AFTER)},
+            )
         except Exception as e:
             return AddResponse(code=500, error_desc=str(e))
 
@@ -94,13 +99,24 @@ def init_users_routes(app: FastAPI, oauth2_scheme):
     async def get_by_id(
         current_user: Annotated[User, Depends(get_current_user)],
         id: int,
-        session: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_read_session),
     ) -> Any:
         try:
+            etag = user_etags.get(id)
+            if etag_matches(request, etag):
+                return not_modified(etag)
             result = await User.get_by_id(session, id)
             if result.is_error is True:
                 return UserResponse(code=500, error_desc=result.error_desc)
-            return UserResponse(code=200, value=User.from_one_to_schema(result.value))
+            user = User.from_one_to_schema(result.value)
+            if user is not None:
+                etag = user_etags.remember(user.id, user)
+                if etag_matches(request, etag):
+                    return not_modified(etag)
+                response.headers["ETag"] = etag
+            return UserResponse(code=200, value=user)
         except Exception as e:
             return UserResponse(code=500, error_desc=str(e))
 
@@ -108,7 +124,7 @@ def init_users_routes(app: FastAPI, oauth2_scheme):
     async def get_by_username(
         current_user: Annotated[User, Depends(get_current_user)],
         username: str,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ) -> Any:
         try:
             result = await User.get_by_username(session, username)
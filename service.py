@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from dotenv import load_dotenv
@@ -6,17 +7,21 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import OAuth2PasswordBearer
-from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
 
-from db import engine
-from models.book import init_book
-from models.post import init_post
-from models.user import init_user
+from db import engine, prime_pool, read_engine
+from models.stats import rebuild_counters
+import limiter
+import profiler
+from metrics import MetricsMiddleware, instrument_engine
+from migrations import migrate, reset
+from responses import FastJSONResponse
 
 # pylint: disable=E0401
 from routes.auth import init_auth_routes
 from routes.books import init_books_routes
 from routes.posts import init_posts_routes
+from routes.stats import init_stats_routes
+from routes.system import init_system_routes
 from routes.users import init_users_routes
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -24,26 +29,11 @@ if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
 
-
-
-app = FastAPI()
-
 origins = ["*"]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
 
 
-def custom_openapi():
+def custom_openapi(app: FastAPI):
     if app.openapi_schema:
         return app.openapi_schema
     openapi_schema = get_openapi(
@@ -56,21 +46,119 @@ def custom_openapi():
     return openapi_schema
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A worker forked from a parent that already touched the engines must not
+    # share its pooled connections; drop them without closing the parent's.
+    await engine.dispose(close=False)
+    if read_engine is not engine:
+        await read_engine.dispose(close=False)
+    for target in {engine, read_engine}:
+        await prime_pool(target)
+    yield
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+    if limiter.ENABLED:
+        # Innermost, so shed responses still get CORS headers and metrics.
+        app.add_middleware(limiter.LoadSheddingMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+    instrument_engine(read_engine)
+    if profiler.ENABLED:
+        app.add_middleware(profiler.SQLProfilerMiddleware)
+        profiler.instrument_engine(engine)
+        profiler.instrument_engine(read_engine)
+    init_books_routes(app, oauth2_scheme)
+    init_posts_routes(app, oauth2_scheme)
+    init_users_routes(app, oauth2_scheme)
+    init_stats_routes(app, oauth2_scheme)
+    init_auth_routes(app)
+    init_system_routes(app)
+    app.openapi_schema = custom_openapi(app)
+    return app
+
+
 async def init_models():
     try:
         if os.environ.get("REINIT_DB") == "1":
-            await init_book(engine)
-            await init_user(engine)
-            await init_post(engine)
+            await reset(engine)
+        await migrate(engine)
+        # Pooled connections belong to this event loop; the server runs its own.
+        await engine.dispose()
         print("Done")
     except Exception as e:
         print(e)
 
 
+async def rebuild_stats():
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_counters)
+    await engine.dispose()
+    print("Stats rebuilt")
+
+
+def run_gunicorn(host: str, port: int, workers: int) -> bool:
+    """Serve through gunicorn when it is installed: it respawns dead workers,
+    recycles them after MAX_REQUESTS and restarts them gracefully on SIGHUP."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print(
+            "gunicorn is not installed; falling back to uvicorn's supervisor, "
+            "which neither recycles workers after MAX_REQUESTS nor restarts "
+            "them gracefully"
+        )
+        return False
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set(
+                "graceful_timeout", int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+            )
+            self.cfg.set("max_requests", int(os.environ.get("MAX_REQUESTS", "0")))
+            self.cfg.set(
+                "max_requests_jitter", int(os.environ.get("MAX_REQUESTS_JITTER", "0"))
+            )
+
+        def load(self):
+            return create_app()
+
+    Server().run()
+    return True
+
+
 def run():
-    init_books_routes(app, oauth2_scheme)
-    init_posts_routes(app, oauth2_scheme)
-    init_users_routes(app, oauth2_scheme)
-    init_auth_routes(app)
-    app.openapi_schema = custom_openapi()
-    uvicorn.run(app, host=os.environ.get("HOST"), port=int(os.environ.get("PORT")))
+    host = os.environ.get("HOST")
+    port = int(os.environ.get("PORT"))
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers > 1:
+        print("WORKERS > 1: each /metrics scrape reports a single worker")
+    if workers > 1 and os.environ.get("SERVER") != "uvicorn":
+        if run_gunicorn(host, port, workers):
+            return
+    # "auto" picks uvloop and httptools when they are installed.
+    uvicorn.run(
+        "service:create_app",
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        loop=os.environ.get("UVICORN_LOOP", "auto"),
+        http=os.environ.get("UVICORN_HTTP", "auto"),
+        timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_TIMEOUT", "30")),
+    )
@@ -1,33 +1,31 @@
+import asyncio
 import json
 import os
 import random
 import string
+import httpx
+import pytest
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.security import OAuth2PasswordBearer
-from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
 from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+from db import engine
 from models.book import Book
 from models.user import User
 from models.post import Post
-from routes.books import init_books_routes
-from routes.posts import init_posts_routes
-from routes.users import init_users_routes
-from routes.auth import init_auth_routes
+from models.stats import AuthorBookCount, BookPostCount, UserPostCount
+from models.stats import rebuild_counters
+from service import create_app
+import hashing
+import limiter
+import routes.auth
+import routes.posts
 
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-app = FastAPI()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
-
-init_books_routes(app, oauth2_scheme)
-init_posts_routes(app, oauth2_scheme)
-init_users_routes(app, oauth2_scheme)
-init_auth_routes(app)
+app = create_app()
 
 client = TestClient(app)
 auth = ""
@@ -152,3 +150,489 @@ def test_post_get_by_page():
         f"/posts/get/page/1", headers={"Authorization": f"Bearer {auth}"}
     )
     assert response.json()["code"] == 200
+
+
+def test_post_search_escapes_html():
+    test_data = {
+        "user_id": test_post.user_id,
+        "book_id": test_post.book_id,
+        "title": "Escaped",
+        "text": "<script>alert(1)</script> snippetmarker",
+    }
+    response = client.post(
+        "/posts/add",
+        data=json.dumps(test_data),
+        headers={"Authorization": f"Bearer {auth}"},
+    )
+    assert response.json()["code"] == 200
+    response = client.get(
+        "/posts/search?q=snippetmarker", headers={"Authorization": f"Bearer {auth}"}
+    )
+    assert response.json()["code"] == 200
+    snippet = response.json()["value"][0]["text_snippet"]
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet
+    assert "<b>snippetmarker</b>" in snippet
+
+
+def test_book_add_bulk():
+    test_data = [
+        {"name": "Bulk1", "author": "Author1"},
+        {"name": test_book.name, "author": test_book.author},
+        {"name": "Bulk1", "author": "Author2"},
+        {"name": "Bulk2", "author": "Author2"},
+    ]
+    response = client.post(
+        "/books/bulk",
+        data=json.dumps(test_data),
+        headers={"Authorization": f"Bearer {auth}"},
+    )
+    assert response.json()["code"] == 200
+    items = response.json()["value"]
+    assert [item["index"] for item in items] == [0, 1, 2, 3]
+    assert [item["id"] is None for item in items] == [False, True, True, False]
+    assert items[1]["error_desc"] and items[2]["error_desc"]
+    for item, book in zip(items, test_data):
+        if item["id"] is not None:
+            response = client.get(
+                f"/books/get/id/{item['id']}",
+                headers={"Authorization": f"Bearer {auth}"},
+            )
+            assert response.json()["value"]["name"] == book["name"]
+
+
+def test_post_add_bulk():
+    test_data = [
+        {"user_id": test_user.id, "book_id": test_book.id, "title": "Bulk1"},
+        {"user_id": 1000, "book_id": test_book.id, "title": "Bulk2"},
+        {"user_id": test_user.id, "book_id": 1000, "title": "Bulk3"},
+        {"user_id": test_user.id, "book_id": test_book.id, "title": "Bulk4"},
+    ]
+    for post in test_data:
+        post["text"] = "Text for bulk post"
+    response = client.post(
+        "/posts/bulk",
+        data=json.dumps(test_data),
+        headers={"Authorization": f"Bearer {auth}"},
+    )
+    assert response.json()["code"] == 200
+    items = response.json()["value"]
+    assert [item["index"] for item in items] == [0, 1, 2, 3]
+    assert [item["id"] is None for item in items] == [False, True, True, False]
+    assert items[1]["error_desc"] and items[2]["error_desc"]
+    for item, post in zip(items, test_data):
+        if item["id"] is not None:
+            response = client.get(
+                f"/posts/get/id/{item['id']}",
+                headers={"Authorization": f"Bearer {auth}"},
+            )
+            assert response.json()["value"]["title"] == post["title"]
+
+
+def test_post_get_feed():
+    response = client.get("/posts/get/all")
+    all_ids = sorted(post["id"] for post in response.json()["value"])
+    assert len(all_ids) > 2
+    feed_ids, after, pages = [], None, 0
+    while True:
+        url = "/posts/feed?limit=2" + (f"&after={after}" if after else "")
+        response = client.get(url, headers={"Authorization": f"Bearer {auth}"})
+        assert response.json()["code"] == 200
+        feed_ids += [post["id"] for post in response.json()["value"]]
+        after = response.json()["next_cursor"]
+        pages += 1
+        if after is None:
+            break
+    assert feed_ids == all_ids
+    assert pages == (len(all_ids) + 1) // 2
+
+
+def test_post_get_feed_invalid_cursor():
+    response = client.get(
+        "/posts/feed?after=not-a-cursor", headers={"Authorization": f"Bearer {auth}"}
+    )
+    assert response.json()["code"] == 400
+
+
+def test_book_get_conditional():
+    headers = {"Authorization": f"Bearer {auth}"}
+    test_data = {"name": "ETagBook", "author": "Author1"}
+    response = client.post("/books/add", data=json.dumps(test_data), headers=headers)
+    book_id = response.json()["value"]
+    response = client.get(f"/books/get/id/{book_id}", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag
+    response = client.get(
+        f"/books/get/id/{book_id}", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    response = client.get(
+        f"/books/get/name/{test_data['name']}",
+        headers={**headers, "If-None-Match": etag},
+    )
+    assert response.status_code == 304
+
+    client.delete(f"/books/delete/{book_id}", headers=headers)
+    response = client.get(
+        f"/books/get/id/{book_id}", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    # The freed id is handed out again; the new row must not match the old tag.
+    test_data["author"] = "Author2"
+    response = client.post("/books/add", data=json.dumps(test_data), headers=headers)
+    assert response.json()["value"] == book_id
+    response = client.get(
+        f"/books/get/id/{book_id}", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["value"]["author"] == "Author2"
+    assert response.headers["ETag"] != etag
+
+
+def test_post_get_conditional():
+    headers = {"Authorization": f"Bearer {auth}"}
+    test_data = {
+        "user_id": test_post.user_id,
+        "book_id": test_post.book_id,
+        "title": "ETagPost",
+        "text": test_post.text,
+    }
+    response = client.post("/posts/add", data=json.dumps(test_data), headers=headers)
+    post_id = response.json()["value"]
+    response = client.get(f"/posts/get/id/{post_id}", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag
+    response = client.get(
+        f"/posts/get/id/{post_id}", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    client.delete(f"/posts/delete/{post_id}", headers=headers)
+    response = client.get(
+        f"/posts/get/id/{post_id}", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+
+def test_book_delete_unlinks_posts():
+    headers = {"Authorization": f"Bearer {auth}"}
+    test_data = [
+        {"name": "Unlink1", "author": "Author3"},
+        {"name": "Unlink2", "author": "Author3"},
+    ]
+    response = client.post("/books/bulk", data=json.dumps(test_data), headers=headers)
+    book_id = response.json()["value"][1]["id"]
+    test_data = {
+        "user_id": test_user.id,
+        "book_id": book_id,
+        "title": "Unlinked",
+        "text": test_post.text,
+    }
+    response = client.post("/posts/add", data=json.dumps(test_data), headers=headers)
+    post_id = response.json()["value"]
+
+    response = client.delete(f"/books/delete/{book_id}", headers=headers)
+    assert response.json()["code"] == 200
+    response = client.get(f"/posts/get/id/{post_id}", headers=headers)
+    assert response.json()["value"]["book_id"] is None
+    # SQLite hands the freed id to the next book, which must start with no posts.
+    test_data = {"name": "Unlink3", "author": "Author3"}
+    response = client.post("/books/add", data=json.dumps(test_data), headers=headers)
+    assert response.json()["value"] == book_id
+    response = client.get(f"/posts/get/book/{book_id}", headers=headers)
+    assert response.json()["code"] == 200
+    assert response.json()["value"] == []
+
+
+def read_counters(rebuild: bool = False) -> dict:
+    async def read():
+        async with engine.begin() as conn:
+            if rebuild:
+                await conn.run_sync(rebuild_counters)
+            counters = {}
+            for model in (UserPostCount, BookPostCount, AuthorBookCount):
+                rows = await conn.execute(select(model.__table__))
+                # A counter that dropped to zero equals a missing row.
+                counters[model.__tablename__] = {r for r in rows.all() if r[-1]}
+            return counters
+
+    return asyncio.run(read())
+
+
+def test_stats_match_rebuild():
+    headers = {"Authorization": f"Bearer {auth}"}
+    test_data = [
+        {"name": "Stats1", "author": "Author4"},
+        {"name": "Stats2", "author": "Author4"},
+    ]
+    response = client.post("/books/bulk", data=json.dumps(test_data), headers=headers)
+    book_ids = [item["id"] for item in response.json()["value"]]
+    test_data = {
+        "user_id": test_user.id,
+        "book_id": book_ids[0],
+        "title": "Stats",
+        "text": test_post.text,
+    }
+    response = client.post("/posts/add", data=json.dumps(test_data), headers=headers)
+    post_id = response.json()["value"]
+    test_data = [
+        {"user_id": test_user.id, "book_id": book_id, "title": "Stats"}
+        for book_id in book_ids * 2
+    ]
+    for post in test_data:
+        post["text"] = test_post.text
+    client.post("/posts/bulk", data=json.dumps(test_data), headers=headers)
+    response = client.get(f"/stats/books/{book_ids[0]}/posts", headers=headers)
+    assert response.json()["value"] == 3
+    client.delete(f"/posts/delete/{post_id}", headers=headers)
+    client.delete(f"/books/delete/{book_ids[1]}", headers=headers)
+    test_data = {"name": "Stats3", "author": "Author4"}
+    response = client.post("/books/add", data=json.dumps(test_data), headers=headers)
+    assert response.json()["value"] == book_ids[1]
+
+    response = client.get(f"/stats/books/{book_ids[0]}/posts", headers=headers)
+    assert response.json()["value"] == 2
+    response = client.get(f"/stats/books/{book_ids[1]}/posts", headers=headers)
+    assert response.json()["value"] == 0
+    response = client.get("/stats/authors/Author4/books", headers=headers)
+    assert response.json()["value"] == 2
+    assert read_counters() == read_counters(rebuild=True)
+
+
+def send_concurrently(requests: list, target=app) -> list:
+    """Send (method, url, body) requests to the app at once on one event loop."""
+
+    async def send():
+        transport = httpx.ASGITransport(app=target)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as http:
+            responses = await asyncio.gather(
+                *(
+                    http.request(
+                        method,
+                        url,
+                        json=body,
+                        headers={"Authorization": f"Bearer {auth}"},
+                    )
+                    for method, url, body in requests
+                )
+            )
+        # Pooled connections stay with this event loop.
+        await engine.dispose()
+        return responses
+
+    return asyncio.run(send())
+
+
+def test_post_add_batched(monkeypatch):
+    monkeypatch.setattr(routes.posts, "BATCH_POSTS", True)
+    flushes = []
+    monkeypatch.setattr(routes.posts.post_batcher, "on_flush", flushes.append)
+    test_data = [
+        {
+            "user_id": test_user.id if i % 5 else 1000,
+            "book_id": test_book.id if i % 7 else 1000,
+            "title": f"Batched{i}",
+            "text": test_post.text,
+        }
+        for i in range(30)
+    ]
+    responses = send_concurrently([("POST", "/posts/add", post) for post in test_data])
+    ids = set()
+    for post, response in zip(test_data, responses):
+        if post["user_id"] == 1000 or post["book_id"] == 1000:
+            assert response.json()["code"] == 500
+            assert response.json()["error_desc"]
+            continue
+        assert response.json()["code"] == 200
+        post_id = response.json()["value"]
+        ids.add(post_id)
+        response = client.get(
+            f"/posts/get/id/{post_id}", headers={"Authorization": f"Bearer {auth}"}
+        )
+        assert response.json()["value"]["title"] == post["title"]
+    assert len(ids) == len([p for p in test_data if 1000 not in p.values()])
+    assert sum(flushes) == len(test_data)
+    assert len(flushes) < len(test_data)
+
+
+def test_post_get_all_coalesced(monkeypatch):
+    monkeypatch.setattr(limiter, "ENABLED", True)
+    queries = []
+
+    def count_post_queries(conn, cursor, statement, *args):
+        if "FROM posts" in statement:
+            queries.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_post_queries)
+    try:
+        responses = send_concurrently([("GET", "/posts/get/all", None)] * 20)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_post_queries)
+    # One flight served everyone, and requests that joined it took no slot
+    # in the heavy route class.
+    assert len(queries) == 1
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses}) == 1
+
+
+def test_post_stream_all():
+    response = client.get("/posts/stream/all")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    response = client.get("/posts/get/all")
+    listed = sorted(response.json()["value"], key=lambda post: post["id"])
+    assert streamed == listed
+
+
+def register_and_login(username: str) -> tuple[int, str]:
+    test_data = {"username": username, "password": f"{username}Password"}
+    response = client.post("/reg", data=json.dumps(test_data))
+    user_id = response.json()["value"]
+    response = client.post("/login", data=test_data)
+    return user_id, response.json()["access_token"]
+
+
+@pytest.mark.parametrize("stateless", [False, True])
+def test_logout_revokes_tokens(monkeypatch, stateless):
+    monkeypatch.setattr(routes.auth, "STATELESS_AUTH", stateless)
+    username = f"Logout{stateless}"
+    user_id, token = register_and_login(username)
+    other_token = client.post(
+        "/login", data={"username": username, "password": f"{username}Password"}
+    ).json()["access_token"]
+    response = client.post("/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 204
+    for revoked in (token, other_token):
+        response = client.get(
+            f"/users/get/id/{user_id}", headers={"Authorization": f"Bearer {revoked}"}
+        )
+        assert response.status_code == 401
+    response = client.post(
+        "/login", data={"username": username, "password": f"{username}Password"}
+    )
+    token = response.json()["access_token"]
+    response = client.get(
+        f"/users/get/id/{user_id}", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.json()["code"] == 200
+
+
+@pytest.mark.parametrize("stateless", [False, True])
+def test_user_delete_revokes_tokens(monkeypatch, stateless):
+    monkeypatch.setattr(routes.auth, "STATELESS_AUTH", stateless)
+    _, admin_token = register_and_login(f"Admin{stateless}")
+    user_id, token = register_and_login(f"Deleted{stateless}")
+    response = client.delete(
+        f"/users/delete/{user_id}", headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.json()["code"] == 200
+    response = client.post("/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    # SQLite hands the freed id to the next user; the old token must not
+    # authenticate as them.
+    new_user_id, new_token = register_and_login(f"Reused{stateless}")
+    assert new_user_id == user_id
+    response = client.post("/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    response = client.get(
+        f"/users/get/id/{user_id}", headers={"Authorization": f"Bearer {new_token}"}
+    )
+    assert response.json()["code"] == 200
+
+
+def test_user_reg_hash_queue_full(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_QUEUE_LIMIT", 1)
+    test_data = [
+        {"username": f"Queued{i}", "password": f"Queued{i}Password"} for i in range(4)
+    ]
+    responses = send_concurrently([("POST", "/reg", user) for user in test_data])
+    busy = [response for response in responses if response.status_code == 503]
+    assert len(busy) == len(test_data) - 1
+    assert all(response.headers["Retry-After"] == "1" for response in busy)
+    assert [r.json()["code"] for r in responses if r.status_code == 200] == [200]
+    # The slot is free again once the running hash finishes.
+    test_data = {"username": "Queued4", "password": "Queued4Password"}
+    response = client.post("/reg", data=json.dumps(test_data))
+    assert response.json()["code"] == 200
+
+
+def genre_count(genre: str) -> int:
+    response = client.get("/books/genres", headers={"Authorization": f"Bearer {auth}"})
+    assert response.json()["code"] == 200
+    return response.json()["value"].get(genre, 0)
+
+
+def test_book_get_by_genre():
+    headers = {"Authorization": f"Bearer {auth}"}
+    assert genre_count("Fable") == 0
+    test_data = {"name": "Genre0", "author": "Author5", "genre": "Fable"}
+    response = client.post("/books/add", data=json.dumps(test_data), headers=headers)
+    book_ids = [response.json()["value"]]
+    assert genre_count("Fable") == 1
+    test_data = [
+        {"name": f"Genre{i}", "author": "Author5", "genre": "Fable"} for i in (1, 2, 3)
+    ]
+    response = client.post("/books/bulk", data=json.dumps(test_data), headers=headers)
+    book_ids += [item["id"] for item in response.json()["value"]]
+    assert genre_count("Fable") == 4
+
+    response = client.get("/books/get/genre/Fable?limit=3", headers=headers)
+    assert response.json()["code"] == 200
+    assert [book["id"] for book in response.json()["value"]] == book_ids[:3]
+    after = response.json()["next_cursor"]
+    response = client.get(
+        f"/books/get/genre/Fable?limit=3&after={after}", headers=headers
+    )
+    assert [book["id"] for book in response.json()["value"]] == book_ids[3:]
+    assert response.json()["next_cursor"] is None
+    response = client.get("/books/get/genre/Fable?after=not-a-cursor", headers=headers)
+    assert response.json()["code"] == 400
+
+    client.delete(f"/books/delete/{book_ids[0]}", headers=headers)
+    assert genre_count("Fable") == 3
+
+
+def test_load_shedding(monkeypatch):
+    monkeypatch.setenv("LIMIT_AUTH_INITIAL", "1")
+    monkeypatch.setenv("LIMIT_AUTH_QUEUE", "1")
+    monkeypatch.setattr(limiter, "limits", limiter.build_limits())
+    monkeypatch.setattr(limiter, "QUEUE_TIMEOUT", 0.05)
+    monkeypatch.setattr(limiter, "ENABLED", True)
+    shedding_app = create_app()
+    test_data = [
+        {"username": f"Shed{i}", "password": f"Shed{i}Password"} for i in range(6)
+    ]
+    monitoring = ["/metrics", "/db/pool", "/docs"]
+    responses = send_concurrently(
+        [("POST", "/reg", user) for user in test_data]
+        + [("GET", url, None) for url in monitoring],
+        shedding_app,
+    )
+    registered = responses[: len(test_data)]
+    shed = [response for response in registered if response.status_code == 503]
+    # One request runs, one may wait in the queue; the rest are turned away.
+    assert len(test_data) - 2 <= len(shed) < len(test_data)
+    assert all(response.headers["Retry-After"] == "1" for response in shed)
+    for response in registered:
+        if response.status_code == 200:
+            assert response.json()["code"] == 200
+    for response in responses[len(test_data) :]:
+        assert response.status_code == 200
+
+
+def test_adaptive_limit_adapts():
+    limit = limiter.AdaptiveLimit("test", 4, 8, 4, 0.1)
+    # Fast requests while the cap is saturated grow it.
+    limit.in_flight = 3
+    limit._adapt(0.01)
+    assert limit.limit > 4
+    grown = limit.limit
+    # A request over the target shrinks it by BACKOFF.
+    limit._adapt(1.0)
+    assert limit.limit == grown * limiter.BACKOFF
+    # Another slow request within the same target interval doesn't shrink again.
+    limit._adapt(1.0)
+    assert limit.limit == grown * limiter.BACKOFF